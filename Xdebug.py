@@ -1,24 +1,59 @@
 import sublime
 import sublime_plugin
 import os
+import mmap
+import re
+import select
 import socket
+import struct
+import tempfile
 import base64
+import bisect
+import collections
+import difflib
+import hashlib
 import threading
+import time
 import types
 import json
+import urllib
 import webbrowser
-from xml.dom.minidom import parseString
+import zlib
+from cStringIO import StringIO
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
 
 
 xdebug_current = None
 original_layout = None
 debug_view = None
+server = None
 protocol = None
+context_data = None
+trace = None
+script_output = None
+debug_panels = {}  # name : (view, lines)
 buffers = {}
+closed_views = {}  # resolved path : XdebugView of a closed file that still has breakpoints
+breakpoint_stores = {}  # project folders : BreakpointStore
+exception_breakpoints = {}  # exception name : { session id: breakpoint id }
+watches = []  # expressions evaluated at every break
+path_mapping = None
+open_views = None  # resolved path : view, rebuilt after views open, close or are renamed
+spill_files = {}  # view id : spill file of a full value, deleted when the view closes
 breakpoint_icon = '../Xdebug/icons/breakpoint'
 current_icon = '../Xdebug/icons/current'
 current_breakpoint_icon = '../Xdebug/icons/current_breakpoint'
 
+try:
+    memoryview
+except NameError:
+    # Python 2.6 has no memoryview, fall back to recv and a slice copy
+    memoryview = None
+
 
 class DebuggerException(Exception):
     pass
@@ -37,24 +72,56 @@ class Protocol(object):
     Represents DBGp Protocol Language
     '''
 
-    read_rate = 1024
-    port = 9000
+    read_rate = 8192
 
-    def __init__(self):
-        self.port = get_project_setting('port') or get_setting('port') or self.port
+    def __init__(self, sock=None, id=0, read_rate=None):
+        self.read_rate = read_rate or self.read_rate
+        self.id = id
+        self.sock = None
+        self.recorder = None
+        self.buffer = bytearray(self.read_rate)
+        self.buffer_start = 0
+        self.buffer_end = 0
         self.clear()
+        self.started = time.time()
+        self.first_break = None
+        if sock:
+            self.sock = sock
+            self.connected = True
 
     def clear(self):
-        self.buffer = ''
+        self.callbacks = {}
+        self.fileuri = ''
+        self.location = None
+        self.context_names = {}
+        self.generation = 0
+        self.depth = 0
+        self.frame_trees = {}
+        self.frame_order = []
+        self.superglobals = []
+        self.watches = {}  # expression : eval reply, or callbacks waiting for it
+        self.stats = None
+        self.variables = None
+        self.frames = None
+        self.batch = None
+        self.first_byte = None
         self.connected = False
-        self.listening = False
-        self.server = None
         del self.transaction_id
+        # The I/O thread may be blocked in recv on this socket, close only
+        # drops our reference to it and shutdown is what wakes the reader
+        # and ends the connection for the engine
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except:
+            pass
         try:
             self.sock.close()
         except:
             pass
         self.sock = None
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
 
     def transaction_id():
         '''
@@ -74,37 +141,106 @@ class Protocol(object):
 
     transaction_id = property(**transaction_id())
 
-    def read_until_null(self):
-        if self.connected:
-            while not '\x00' in self.buffer:
-                self.buffer += self.sock.recv(self.read_rate)
-            data, self.buffer = self.buffer.split('\x00', 1)
-            return data
+    def reserve(self, size):
+        '''
+        Make room for size unread bytes in the receive buffer.
+
+        Unread bytes are moved to the front of the buffer, which is only
+        reallocated when a frame larger than any seen before arrives.
+        '''
+        unread = self.buffer_end - self.buffer_start
+        if self.buffer_start + size <= len(self.buffer):
+            return
+        if size > len(self.buffer):
+            buffer = bytearray(max(size, len(self.buffer) * 2))
+            buffer[:unread] = self.buffer[self.buffer_start:self.buffer_end]
+            self.buffer = buffer
         else:
-            raise(ProtocolConnectionException, "Not Connected")
+            self.buffer[:unread] = self.buffer[self.buffer_start:self.buffer_end]
+        self.buffer_start = 0
+        self.buffer_end = unread
+
+    def receive(self, limit):
+        '''
+        Receive at most up to buffer offset limit, returns the byte count
+        '''
+        wanted = limit - self.buffer_end
+        try:
+            if memoryview:
+                count = self.sock.recv_into(memoryview(self.buffer)[self.buffer_end:limit], wanted)
+            else:
+                data = self.sock.recv(wanted)
+                count = len(data)
+                self.buffer[self.buffer_end:self.buffer_end + count] = data
+        except Exception, x:
+            raise ProtocolConnectionException(x)
+        if not count:
+            raise ProtocolConnectionException('Connection closed')
+        if trace and not self.first_byte:
+            self.first_byte = time.time()
+        self.buffer_end += count
+        return count
+
+    def read_until_null(self):
+        '''
+        Read the length prefix of the next frame
+        '''
+        if not self.connected:
+            raise ProtocolConnectionException('Not Connected')
+        scanned = 0
+        while True:
+            end = self.buffer.find('\x00', self.buffer_start + scanned, self.buffer_end)
+            if end != -1:
+                break
+            scanned = self.buffer_end - self.buffer_start
+            self.reserve(scanned + self.read_rate)
+            self.receive(self.buffer_end + self.read_rate)
+        data = str(self.buffer[self.buffer_start:end])
+        self.buffer_start = end + 1
+        return data
 
     def read_data(self):
-        length = self.read_until_null()
-        message = self.read_until_null()
-        if int(length) == len(message):
-            return message
+        '''
+        Read one length prefixed DBGp frame
+        '''
+        if trace:
+            self.first_byte = time.time() if self.buffer_end > self.buffer_start else None
+        try:
+            length = int(self.read_until_null())
+        except ValueError:
+            raise ProtocolException('Invalid length prefix')
+        self.reserve(length + 1)
+        end = self.buffer_start + length
+        while self.buffer_end <= end:
+            self.receive(end + 1)
+        if self.buffer[end] != 0:
+            raise ProtocolException('Length mismatch')
+        # Slicing a bytearray copies, so str of a slice copies twice
+        if memoryview:
+            message = memoryview(self.buffer)[self.buffer_start:end].tobytes()
         else:
-            raise(ProtocolException, "Length mismatch")
-
-    def read(self):
-        data = self.read_data()
-        #print '<---', data
-        document = parseString(data)
-        return document
+            message = str(self.buffer[self.buffer_start:end])
+        self.buffer_start = end + 1
+        if self.buffer_start == self.buffer_end:
+            self.buffer_start = self.buffer_end = 0
+        if self.recorder:
+            self.recorder.write(Recorder.RECEIVED, message)
+        return message
 
     def send(self, command, *args, **kwargs):
-        if 'data' in kwargs:
-            data = kwargs['data']
-            del kwargs['data']
-        else:
-            data = None
+        '''
+        Send a command without waiting for the reply.
+
+        The reply is passed to the callback keyword argument on the main
+        thread, as raw XML when raw=True. Returns the transaction id.
+        '''
+        data = kwargs.pop('data', None)
+        callback = kwargs.pop('callback', None)
+        raw = kwargs.pop('raw', False)
 
         tid = self.transaction_id
+        if callback:
+            self.callbacks[tid] = (callback, raw)
         parts = [command, '-i %i' % tid]
 
         if args:
@@ -116,48 +252,1240 @@ class Protocol(object):
         if data:
             command += ' -- ' + base64.b64encode(data)
 
+        if trace:
+            trace.sending(self, tid, command)
+        if self.recorder:
+            self.recorder.write(Recorder.SENT, command)
+        if self.batch is not None:
+            self.batch.append(command + '\x00')
+        else:
+            try:
+                self.sock.sendall(command + '\x00')
+                #print '--->', command
+            except Exception, x:
+                self.callbacks.pop(tid, None)
+                raise ProtocolConnectionException(x)
+        if trace:
+            trace.sent(self, tid)
+        return tid
+
+    def start_batch(self):
+        '''
+        Hold back commands from send until send_batch
+        '''
+        self.batch = []
+
+    def send_batch(self):
+        '''
+        Write all commands held since start_batch in a single write
+        '''
+        batch, self.batch = self.batch, None
+        if batch:
+            try:
+                self.sock.sendall(''.join(batch))
+            except Exception, x:
+                raise ProtocolConnectionException(x)
+
+    def join_batch(self):
+        '''
+        Start a batch unless one is already open, returns whether it did.
+        Hand the result to end_batch.
+        '''
+        if self.batch is not None:
+            return False
+        self.start_batch()
+        return True
+
+    def end_batch(self, started):
+        '''
+        Send the batch if join_batch started it, an enclosing batch is
+        left to whoever opened it
+        '''
+        if started:
+            self.send_batch()
+
+    def serve(self, init_callback, close_callback=None):
+        '''
+        Read and dispatch packets until the connection closes.
+
+        Runs on the I/O thread. Replies are parsed here and matched to
+        their callback by transaction id, the callbacks themselves run on
+        the main thread through sublime.set_timeout.
+        '''
+        while self.connected:
+            try:
+                data = self.read_data()
+                received = trace and time.time()
+                response = parse_response(data)
+            except Exception:
+                if self.connected:
+                    self.connected = False
+                    if close_callback:
+                        sublime.set_timeout(close_callback, 0)
+                break
+
+            if response.name == 'stream':
+                # Script output, not a reply to any command
+                if script_output:
+                    script_output.append(response.text)
+                continue
+            if response.name == 'notify':
+                continue
+            if response.name == 'init':
+                callback, raw = init_callback, False
+            else:
+                callback, raw = self.callbacks.pop(response.transaction_id, (None, False))
+            tid = response.transaction_id
+            if trace:
+                trace.received(self, tid, self.first_byte, received, time.time(), len(data), callback is None)
+            if callback:
+                sublime.set_timeout(lambda callback=callback, arg=(data if raw else response), tid=tid: self.dispatch(callback, arg, tid), 0)
+
+    def dispatch(self, callback, arg, tid=0):
+        '''
+        Run a reply callback on the main thread, unless the session ended
+        while the reply was queued
+        '''
+        if not self.connected:
+            return
+        if trace:
+            started = time.time()
+            callback(arg)
+            trace.rendered(self, tid, started, time.time())
+        else:
+            callback(arg)
+
+
+class Server(object):
+    '''
+    Listens for DBGp connections.
+
+    Every connection becomes its own Protocol session with its own
+    transaction ids, variables and location, served by its own thread.
+    '''
+
+    port = 9000
+
+    def __init__(self):
+        self.port = get_project_setting('port') or get_setting('port') or self.port
+        # Settings can only be read on the main thread, sessions are
+        # created on the listener thread
+        self.read_rate = get_project_setting('read_rate') or get_setting('read_rate')
+        self.sessions = []
+        self.listening = False
+        self.count = 0
+        self.wakeup = None
+        self.record_path = None
+        if get_setting('record'):
+            self.record_path = get_setting('record_path') or os.path.join(sublime.packages_path(), 'User', 'Xdebug', 'sessions')
+
+    def listen(self, init_callback, close_callback):
+        '''
+        Accept connections until stop, runs on the listener thread. Set
+        listening before the thread starts, so a stop that comes first
+        is not missed.
+
+        The thread sleeps in select on the server socket and one end of a
+        wakeup socket pair, so stop takes effect at once. init_callback(session,
+        init) and close_callback(session) are called on the main thread.
+        '''
+        serv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        if not serv:
+            raise ProtocolConnectionException('Could not create socket')
         try:
-            self.sock.send(command + '\x00')
-            #print '--->', command
+            serv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            serv.bind(('', self.port))
+            serv.listen(socket.SOMAXCONN)
+            serv.setblocking(0)
+            wakeup, self.wakeup = wakeup_pair()
         except Exception, x:
-            raise(ProtocolConnectionException, x)
+            self.listening = False
+            raise ProtocolConnectionException(x)
 
-    def accept(self):
-        serv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        while self.listening:
+            readable, writable, errors = select.select([serv, wakeup], [], [])
+            if serv not in readable:
+                continue
+            try:
+                sock, address = serv.accept()
+            except socket.error:
+                continue
+            sock.setblocking(1)
+            self.add(sock, init_callback, close_callback, self.record_path)
 
-        if serv:
+        for sock in (serv, wakeup, self.wakeup):
             try:
-                serv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                serv.settimeout(1)
-                serv.bind(('', self.port))
-                serv.listen(1)
-                self.listening = True
-                self.sock = None
-            except Exception, x:
-                raise(ProtocolConnectionException, x)
+                sock.close()
+            except:
+                pass
+
+    def add(self, sock, init_callback, close_callback, record_path=None):
+        '''
+        Start a session on a connected socket, recording it to a new log in
+        record_path when given
+        '''
+        self.count += 1
+        session = Protocol(sock, self.count, self.read_rate)
+        if record_path:
+            try:
+                if not os.path.isdir(record_path):
+                    os.makedirs(record_path)
+                name = '{time}-{id}.dbgp'.format(time=time.strftime('%Y%m%d-%H%M%S'), id=session.id)
+                session.recorder = Recorder(os.path.join(record_path, name))
+            except (IOError, OSError):
+                pass
+        self.sessions.append(session)
+        threading.Thread(target=session.serve, args=(
+            lambda init, session=session: init_callback(session, init),
+            lambda session=session: close_callback(session))).start()
+        return session
+
+    def get(self, id):
+        for session in self.sessions:
+            if session.id == id:
+                return session
+
+    def remove(self, session):
+        session.clear()
+        if session in self.sessions:
+            self.sessions.remove(session)
+
+    def stop(self):
+        self.listening = False
+        try:
+            self.wakeup.send('\x00')
+        except:
+            pass
+        for session in self.sessions:
+            session.clear()
+        self.sessions = []
+
 
-            while self.listening:
+def wakeup_pair():
+    '''
+    A pair of connected sockets, used as a self-pipe that select can
+    wait on everywhere (pipes can not be selected on Windows)
+    '''
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    writer = socket.create_connection(listener.getsockname())
+    reader, address = listener.accept()
+    listener.close()
+    return reader, writer
+
+
+class Recorder(object):
+    '''
+    Appends the raw DBGp frames of a session to a log file.
+
+    Every record is a header of timestamp, kind and length followed by
+    the frame, zlib compressed when that makes it smaller. Frames come
+    from the main thread (commands) and the I/O thread (replies).
+    '''
+    magic = 'XDBGP-LOG1\n'
+    header = struct.Struct('>dBI')
+    SENT = 0
+    RECEIVED = 1
+    COMPRESSED = 2
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'ab')
+        self.lock = threading.Lock()
+        if not self.file.tell():
+            self.file.write(self.magic)
+
+    def write(self, kind, frame):
+        compressed = zlib.compress(frame)
+        if len(compressed) < len(frame):
+            kind, frame = kind | self.COMPRESSED, compressed
+        self.lock.acquire()
+        try:
+            if self.file:
+                self.file.write(self.header.pack(time.time(), kind, len(frame)))
+                self.file.write(frame)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.file:
+                self.file.close()
+                self.file = None
+        finally:
+            self.lock.release()
+
+
+def read_records(filename):
+    '''
+    Yield (time, kind, frame) from a session log, read through mmap.
+    Logs that are empty, cut short or corrupt raise ProtocolException.
+    '''
+    f = open(filename, 'rb')
+    try:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError), e:
+            # An empty file cannot be mapped
+            raise ProtocolException('Could not read session log {file}: {error}'.format(file=filename, error=e))
+    finally:
+        f.close()
+    try:
+        if data[:len(Recorder.magic)] != Recorder.magic:
+            raise ProtocolException('Not an Xdebug session log: ' + filename)
+        offset = len(Recorder.magic)
+        size = Recorder.header.size
+        while offset < len(data):
+            if offset + size > len(data):
+                raise ProtocolException('Session log is cut short: ' + filename)
+            when, kind, length = Recorder.header.unpack_from(data, offset)
+            offset += size
+            if offset + length > len(data):
+                raise ProtocolException('Session log is cut short: ' + filename)
+            frame = data[offset:offset + length]
+            offset += length
+            if kind & Recorder.COMPRESSED:
+                try:
+                    frame = zlib.decompress(frame)
+                except zlib.error, e:
+                    raise ProtocolException('Corrupt session log {file}: {error}'.format(file=filename, error=e))
+            yield when, kind & ~Recorder.COMPRESSED, frame
+    finally:
+        data.close()
+
+
+class ReplaySocket(object):
+    '''
+    Stands in for the engine socket to replay a recorded session.
+
+    Replies are handed out as the client asks: each command gets the
+    next recorded reply to the same command since the last break, with
+    the transaction id of the client. run and the step commands move on
+    to the next recorded break. Commands without a recorded reply get an
+    error, so the client does not have to repeat the recording exactly.
+    '''
+    continuations = ('run', 'step_into', 'step_over', 'step_out', 'stop', 'detach')
+    command_pattern = re.compile(r'\bcommand="([^"]*)"')
+    transaction_pattern = re.compile(r'\btransaction_id="[^"]*"')
+
+    def __init__(self, filename):
+        self.records = self.read_replies(filename)
+        self.condition = threading.Condition()
+        self.outgoing = []  # framed packets ready for the client
+        self.pending = ''
+        self.replies = {}  # command : replies recorded at the current break
+        self.streams = []  # packets recorded on the way to the next break
+        self.next_break = None
+        self.closed = False
+        self.count = 0
+        self.started = time.time()
+        self.load_break()
+        if not self.streams:
+            raise ProtocolException('Nothing recorded in ' + filename)
+        # The init packet and anything before the first command go out now
+        for frame in self.streams:
+            self.queue(frame)
+        self.streams = []
+
+    def read_replies(self, filename):
+        for when, kind, frame in read_records(filename):
+            if kind == Recorder.RECEIVED:
+                match = self.command_pattern.search(frame)
+                yield match and match.group(1) or '', frame
+
+    def load_break(self):
+        '''
+        Collect the replies recorded up to the reply of the next run or
+        step command
+        '''
+        self.replies = {}
+        self.next_break = None
+        for command, frame in self.records:
+            if command in self.continuations:
+                self.next_break = frame
+                break
+            elif command:
+                self.replies.setdefault(command, collections.deque()).append(frame)
+            else:
+                self.streams.append(frame)
+
+    def queue(self, frame):
+        self.outgoing.append('{length}\x00{frame}\x00'.format(length=len(frame), frame=frame))
+        self.count += 1
+
+    def reply(self, name):
+        if name in self.continuations:
+            for frame in self.streams:
+                self.queue(frame)
+            self.streams = []
+            frame = self.next_break
+            if frame:
                 try:
-                    self.sock, address = serv.accept()
-                    self.listening = False
-                except socket.timeout:
+                    self.load_break()
+                except ProtocolException, e:
+                    # Runs inside sendall, the replay ends at this break
+                    # instead of failing the command that moved on
+                    sublime.set_timeout(lambda: sublime.status_message('Xdebug: Replay ends early, {error}'.format(error=e)), 0)
+            return frame
+        if self.replies.get(name):
+            return self.replies[name].popleft()
+        return ('<response xmlns="urn:debugger_protocol_v1" command="{name}" transaction_id="0">'
+                '<error code="999"><message>Not in the recording</message></error></response>').format(name=name)
+
+    def sendall(self, data):
+        self.condition.acquire()
+        try:
+            for command in data.split('\x00'):
+                if not command:
+                    continue
+                parts = command.split(' ')
+                frame = self.reply(parts[0])
+                if frame is None:
+                    # The recording ends here, the connection closes
+                    self.closed = True
+                    break
+                tid = parts[parts.index('-i') + 1] if '-i' in parts else '0'
+                self.queue(self.transaction_pattern.sub('transaction_id="{tid}"'.format(tid=tid), frame, 1))
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def recv(self, size):
+        if not self.pending:
+            self.condition.acquire()
+            try:
+                while not self.outgoing and not self.closed:
+                    self.condition.wait()
+                if self.outgoing:
+                    self.pending = ''.join(self.outgoing)
+                    self.outgoing = []
+            finally:
+                self.condition.release()
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def recv_into(self, buffer, size):
+        data = self.recv(size)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.condition.acquire()
+        try:
+            if self.records:
+                self.records.close()
+                self.records = None
+                elapsed = time.time() - self.started
+                sublime.set_timeout(lambda: sublime.status_message('Xdebug: Replayed {count} packets in {ms:.0f} ms'.format(
+                    count=self.count, ms=elapsed * 1000)), 0)
+            self.closed = True
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+
+def local_name(tag):
+    '''
+    Strip the namespace from an ElementTree tag
+    '''
+    return tag.rsplit('}', 1)[-1]
+
+
+class Response(object):
+    '''
+    A DBGp response packet, built from iterparse events.
+
+    Subclasses pick what they need out of the event stream in start/end
+    and may return True from either to stop parsing early. Every element
+    is cleared once it has ended, so subtrees nobody asked for are dropped.
+    '''
+    def __init__(self, name, attrib):
+        self.name = name
+        self.attrib = attrib
+        self.command = attrib.get('command', '')
+        self.transaction_id = int(attrib.get('transaction_id') or 0)
+        self.status = attrib.get('status', '')
+        self.reason = attrib.get('reason', '')
+        self.text = ''
+        self.error_code = None
+        self.error_message = ''
+
+    def get(self, attr, default=''):
+        return self.attrib.get(attr, default)
+
+    def parse(self, events):
+        for event, elem in events:
+            name = local_name(elem.tag)
+            if event == 'start':
+                if self.start(name, elem):
+                    break
+            else:
+                done = self.end(name, elem)
+                elem.clear()
+                if done:
+                    break
+        return self
+
+    def start(self, name, elem):
+        if name == 'error':
+            self.error_code = elem.get('code')
+
+    def end(self, name, elem):
+        if name == 'message' and self.error_code is not None:
+            self.error_message = elem.text or ''
+        elif name == self.name:
+            self.text = elem.text or ''
+
+
+class InitResponse(Response):
+    '''
+    The init packet sent by the engine when it connects
+    '''
+    def __init__(self, name, attrib):
+        Response.__init__(self, name, attrib)
+        self.fileuri = attrib.get('fileuri', '')
+
+    def start(self, name, elem):
+        return True
+
+
+class StreamResponse(Response):
+    '''
+    Script output, sent while stdout or stderr is copied or redirected
+    '''
+    def __init__(self, name, attrib):
+        Response.__init__(self, name, attrib)
+        self.type = attrib.get('type', 'stdout')
+
+    def end(self, name, elem):
+        if name == 'stream':
+            text = elem.text or ''
+            if self.get('encoding') == 'base64':
+                try:
+                    text = base64.b64decode(text)
+                except TypeError:
                     pass
+            if isinstance(text, str):
+                text = text.decode('utf-8', 'replace')
+            self.text = text
+
+
+class StatusResponse(Response):
+    '''
+    Reply to run, step_*, stop, detach and status
+    '''
+    def __init__(self, name, attrib):
+        Response.__init__(self, name, attrib)
+        self.filename = None
+        self.lineno = None
+
+    def start(self, name, elem):
+        if name == 'message' and elem.get('filename'):
+            self.filename = elem.get('filename')
+            self.lineno = int(elem.get('lineno') or 0)
+            return True
+        return Response.start(self, name, elem)
+
+
+class BreakpointResponse(Response):
+    '''
+    Reply to breakpoint_set
+    '''
+    def __init__(self, name, attrib):
+        Response.__init__(self, name, attrib)
+        self.id = attrib.get('id')
+
+
+class StackResponse(Response):
+    '''
+    Reply to stack_get, a list of frames as attribute dicts
+    '''
+    def __init__(self, name, attrib):
+        Response.__init__(self, name, attrib)
+        self.frames = []
+
+    def start(self, name, elem):
+        if name == 'stack':
+            self.frames.append(dict(elem.attrib))
+        else:
+            return Response.start(self, name, elem)
+
+
+class Property(object):
+    '''
+    A variable from a context_get or property_get reply.
+
+    Only the raw text is kept, the value is decoded when asked for. Type
+    and encoding names are interned, they repeat for every property.
+    '''
+    __slots__ = ('name', 'fullname', 'type', 'encoding', 'numchildren',
+                 'children', 'parent', 'context', 'pages', 'text', 'size')
+
+    def __init__(self, attrib, parent=None):
+        self.name = attrib.get('name', '')
+        self.fullname = attrib.get('fullname', '')
+        self.type = intern(str(attrib.get('type', '')))
+        self.encoding = intern(str(attrib.get('encoding', '')))
+        self.numchildren = int(attrib.get('numchildren') or 0)
+        self.children = []
+        self.parent = parent
+        self.context = 0
+        self.pages = 0
+        self.text = ''
+        self.size = int(attrib.get('size') or 0)
+
+    def complete(self):
+        return len(self.children) >= self.numchildren
+
+    def truncated(self):
+        '''
+        Whether the engine cut the value short at max_data
+        '''
+        if not self.size:
+            return False
+        length = len(self.text)
+        if self.encoding == 'base64':
+            length = length // 4 * 3 - self.text.count('=', -2)
+        return length < self.size
+
+    def data(self):
+        '''
+        The raw bytes of the value
+        '''
+        return decode_data(self.text, self.encoding)
+
+    @property
+    def value(self):
+        '''
+        The value as unicode, base64 is only decoded when the encoding
+        attribute says so
+        '''
+        value = self.data()
+        if isinstance(value, str):
+            value = value.decode('utf-8', 'replace')
+        return value
+
+
+class PropertyResponse(Response):
+    '''
+    Reply to context_get and property_get, a tree of Property objects
+    '''
+    def __init__(self, name, attrib):
+        Response.__init__(self, name, attrib)
+        self.properties = []
+        self.stack = []
+
+    def start(self, name, elem):
+        if name == 'property':
+            prop = Property(elem.attrib, self.stack and self.stack[-1] or None)
+            if self.stack:
+                self.stack[-1].children.append(prop)
+            else:
+                self.properties.append(prop)
+            self.stack.append(prop)
+        else:
+            return Response.start(self, name, elem)
+
+    def end(self, name, elem):
+        if name == 'property':
+            prop = self.stack.pop()
+            prop.text = elem.text or ''
+            if prop.children:
+                prop.pages = 1
+        else:
+            return Response.end(self, name, elem)
+
 
-            if self.sock:
-                self.connected = True
-                self.sock.settimeout(None)
+class ContextNamesResponse(Response):
+    '''
+    Reply to context_names, a list of (id, name) pairs
+    '''
+    def __init__(self, name, attrib):
+        Response.__init__(self, name, attrib)
+        self.contexts = []
+
+    def start(self, name, elem):
+        if name == 'context':
+            self.contexts.append((int(elem.get('id') or 0), elem.get('name', '')))
+        else:
+            return Response.start(self, name, elem)
+
+
+response_types = {
+    'run': StatusResponse,
+    'step_into': StatusResponse,
+    'step_over': StatusResponse,
+    'step_out': StatusResponse,
+    'stop': StatusResponse,
+    'detach': StatusResponse,
+    'status': StatusResponse,
+    'breakpoint_set': BreakpointResponse,
+    'stack_get': StackResponse,
+    'context_names': ContextNamesResponse,
+    'context_get': PropertyResponse,
+    'property_get': PropertyResponse,
+    'eval': PropertyResponse,
+}
+
+
+def decode_data(text, encoding):
+    if encoding == 'base64':
+        try:
+            return base64.b64decode(text)
+        except TypeError:
+            pass
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def parse_response(data):
+    '''
+    Parse a DBGp packet into a typed Response
+    '''
+    events = ElementTree.iterparse(StringIO(data), ('start', 'end'))
+    event, root = next(events)
+    name = local_name(root.tag)
+    attrib = dict(root.attrib)
+    if name == 'init':
+        cls = InitResponse
+    elif name == 'stream':
+        cls = StreamResponse
+    else:
+        cls = response_types.get(attrib.get('command'), Response)
+    return cls(name, attrib).parse(events)
+
+
+def quote(arg):
+    '''
+    Quote a DBGp command argument such as a property name
+    '''
+    return '"' + arg.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class VariableTree(object):
+    '''
+    The variables of one stack frame of the current break.
+
+    context_get only returns the first levels, as limited by the
+    max_children and max_depth features. Further children are fetched a
+    page at a time with property_get and kept until the next break.
+    size is a rough estimate of the memory held, in bytes.
+    '''
+    def __init__(self, session, depth=0):
+        self.session = session
+        self.depth = depth
+        self.generation = session.generation
+        self.contexts = []  # (context id, properties)
+        self.index = {}
+        self.pending = set()
+        self.loading = 0  # context_get replies still to come
+        self.size = 0
+
+    def release(self):
+        '''
+        Unlink the properties so the tree is freed at once instead of
+        waiting for the cycle collector. Superglobals are shared between
+        frames and left to release_break.
+        '''
+        for context, properties in self.contexts:
+            if not context:
+                release(properties)
+        self.contexts = []
+        self.index = {}
+
+    def add_context(self, context, properties):
+        self.contexts.append((context, properties))
+        self.contexts.sort()
+        self.add(properties, context)
+
+    def add(self, properties, context):
+        for prop in properties:
+            prop.context = context
+            self.index[prop.fullname] = prop
+            self.size += len(prop.fullname) + len(prop.text) + 64
+            self.add(prop.children, context)
+
+    def get(self, fullname):
+        return self.index.get(fullname)
+
+    def fetch(self, prop, callback):
+        '''
+        Fetch the next page of children of prop and call callback(prop)
+        once it is in. Returns False when there is nothing to fetch.
+        '''
+        if prop.complete() or prop.fullname in self.pending:
+            return False
+        self.pending.add(prop.fullname)
+        self.session.send('property_get', '-n ' + quote(prop.fullname), c=prop.context, d=self.depth, p=prop.pages,
+            callback=lambda res: self.loaded(prop, res, callback))
+        return True
+
+    def loaded(self, prop, res, callback):
+        self.pending.discard(prop.fullname)
+        prop.pages += 1
+        if res.properties:
+            children = res.properties[0].children
+            for child in children:
+                child.parent = prop
+            prop.children.extend(children)
+            self.add(children, prop.context)
+        if self.session.frame_trees.get(self.depth) is self:
+            trim_frames(self.session)
+        if self.session.variables is self:
+            callback(prop)
+
+
+class ValueLoader(object):
+    '''
+    Stream the full value of a string cut short by max_data into a spill
+    file and open it read-only.
+
+    The value is read a chunk per round trip with eval and substr, with
+    max_data raised for that one eval and put back in the same write. In
+    other frames than the top one, or when the name is no PHP expression,
+    it is read at once with property_value.
+    '''
+    def __init__(self, session, tree, prop, window):
+        self.session = session
+        self.generation = session.generation
+        self.depth = tree.depth
+        self.prop = prop
+        self.window = window
+        self.chunk = get_setting('value_chunk_size') or 1048576
+        self.max_data = None
+        self.offset = 0
+        self.file = tempfile.NamedTemporaryFile(prefix='xdebug-', suffix='.txt', delete=False)
+
+    def start(self):
+        sublime.status_message('Xdebug: Loading {size} bytes of {name}'.format(size=self.prop.size, name=self.prop.fullname))
+        if self.depth:
+            self.load_whole()
+        else:
+            self.session.send('feature_get', n='max_data', callback=self.started)
+
+    def started(self, res):
+        # What to put back after each chunk. Should the engine not say,
+        # put back what gui_callback set, or else the Xdebug default
+        if res.error_code is None and res.text.strip():
+            self.max_data = res.text.strip()
+        else:
+            self.max_data = get_project_setting('max_data') or get_setting('max_data') or 1024
+        self.load_chunk()
+
+    def load_chunk(self):
+        expression = 'substr({name}, {offset}, {chunk})'.format(name=self.prop.fullname, offset=self.offset, chunk=self.chunk)
+        session = self.session
+        session.start_batch()
+        try:
+            session.send('feature_set', n='max_data', v=self.chunk)
+            session.send('eval', data=expression.encode('utf-8'), callback=self.chunk_loaded)
+            session.send('feature_set', n='max_data', v=self.max_data)
+        finally:
+            session.send_batch()
+
+    def chunk_loaded(self, res):
+        if self.session.generation != self.generation:
+            return self.cancel()
+        if res.error_code is not None or not res.properties:
+            if self.offset:
+                return self.done()
+            return self.load_whole()
+        data = res.properties[0].data()
+        self.file.write(data)
+        self.offset += len(data)
+        if len(data) < self.chunk or self.offset >= self.prop.size:
+            self.done()
+        else:
+            self.load_chunk()
+
+    def load_whole(self):
+        self.session.send('property_value', '-n ' + quote(self.prop.fullname),
+            c=self.prop.context, d=self.depth, m=self.prop.size, callback=self.whole_loaded)
+
+    def whole_loaded(self, res):
+        if self.session.generation != self.generation:
+            return self.cancel()
+        if res.error_code is not None:
+            sublime.status_message('Xdebug: Could not load {name}: {message}'.format(name=self.prop.fullname, message=res.error_message))
+            return self.cancel()
+        self.file.write(decode_data(res.text, res.get('encoding')))
+        self.done()
+
+    def done(self):
+        self.file.close()
+        view = self.window.open_file(self.file.name)
+        view.set_scratch(True)
+        view.set_read_only(True)
+        spill_files[view.id()] = self.file.name
+
+    def cancel(self):
+        self.file.close()
+        remove_file(self.file.name)
+
+
+class Trace(object):
+    '''
+    Per command timings, recorded while tracing is switched on.
+
+    All times are in milliseconds: send is the socket write, ttfb the wait
+    from the write until the first byte of the reply, receive the rest of
+    the reply, parse the XML parse and render the reply callback on the
+    main thread. Only the last trace_size commands are kept.
+    '''
+    def __init__(self):
+        self.records = collections.deque(maxlen=get_setting('trace_size') or 10000)
+        self.pending = {}
+
+    def sending(self, session, tid, command):
+        # Registered before the write, the reply may beat sent()
+        self.pending[(session.id, tid)] = {
+            'session': session.id,
+            'transaction_id': tid,
+            'command': command.split(' ', 1)[0],
+            'time': time.time(),
+            'send': 0.0,
+            'bytes_out': len(command) + 1,
+        }
+
+    def sent(self, session, tid):
+        record = self.pending.get((session.id, tid))
+        if record:
+            record['send'] = (time.time() - record['time']) * 1000
+
+    def received(self, session, tid, first_byte, received, parsed, size, done):
+        record = self.pending.get((session.id, tid))
+        if not record:
+            return
+        sent = record['time'] + record['send'] / 1000
+        first_byte = first_byte or received
+        record['ttfb'] = max(first_byte - sent, 0) * 1000
+        record['receive'] = (received - first_byte) * 1000
+        record['parse'] = (parsed - received) * 1000
+        record['bytes_in'] = size
+        if done:
+            record['render'] = 0.0
+            self.records.append(self.pending.pop((session.id, tid)))
+
+    def rendered(self, session, tid, started, finished):
+        record = self.pending.pop((session.id, tid), None)
+        if record:
+            record['render'] = (finished - started) * 1000
+            self.records.append(record)
+
+    def format(self):
+        lines = ['{session:>3} {transaction_id:>6} {command:<16} send {send:7.2f}  ttfb {ttfb:8.2f}  '
+                 'receive {receive:8.2f}  parse {parse:8.2f}  render {render:8.2f}  '
+                 'in {bytes_in:>9}  out {bytes_out:>6}\n'.format(**record) for record in self.records]
+        return ''.join(lines)
+
+    def export(self, filename):
+        f = open(filename, 'w')
+        try:
+            for record in self.records:
+                f.write(json.dumps(record) + '\n')
+        finally:
+            f.close()
+
+
+class ReplyCounter(object):
+    '''
+    Count the replies to a pipelined batch of commands and report how
+    long the batch took once the last one is in.
+    '''
+    def __init__(self, message):
+        self.message = message
+        self.pending = 0
+        self.total = 0
+        self.started = time.time()
+        self.elapsed = None
+
+    def wrap(self, callback=None):
+        self.pending += 1
+        self.total += 1
+
+        def counted(res):
+            if callback:
+                callback(res)
+            self.pending -= 1
+            if not self.pending:
+                self.elapsed = time.time() - self.started
+                sublime.status_message(self.message.format(count=self.total, ms=self.elapsed * 1000))
+        return counted
+
+
+class ScriptOutput(object):
+    '''
+    Script output from stream packets, shown in the Xdebug Output panel.
+
+    The I/O threads queue the text and the panel is written on the main
+    thread in one edit per output_delay ms. The queue and the panel both
+    keep only the last output_size characters.
+    '''
+    def __init__(self, size, delay):
+        self.size = size
+        self.delay = delay
+        self.chunks = collections.deque()
+        self.queued = 0
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.shown = False
+
+    def append(self, text):
+        self.lock.acquire()
+        try:
+            self.chunks.append(text)
+            self.queued += len(text)
+            while self.queued > self.size and len(self.chunks) > 1:
+                self.queued -= len(self.chunks.popleft())
+            if self.scheduled:
+                return
+            self.scheduled = True
+        finally:
+            self.lock.release()
+        sublime.set_timeout(self.flush, self.delay)
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            chunks, self.chunks = self.chunks, collections.deque()
+            self.queued = 0
+            self.scheduled = False
+        finally:
+            self.lock.release()
+        text = u''.join(chunks)[-self.size:]
+        window = sublime.active_window()
+        if not text or not window:
+            return
+        panel = window.get_output_panel('xdebug_output')
+        edit = panel.begin_edit()
+        panel.insert(edit, panel.size(), text)
+        if panel.size() > self.size:
+            panel.erase(edit, sublime.Region(0, panel.size() - self.size))
+        panel.end_edit(edit)
+        if not self.shown:
+            self.shown = True
+            window.run_command('show_panel', {"panel": 'output.xdebug_output'})
+
+
+class HitStats(object):
+    '''
+    Breakpoint hits recorded by Run with Stats, a histogram keyed by file
+    and line.
+
+    The gap of a hit is the time since the previous hit anywhere, the
+    handling time is what the client spent between a break reply and
+    sending run again.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        self.last = self.started
+        self.locations = {}  # (filename, lineno) : [hits, total gap, min depth, max depth]
+        self.current = None
+        self.hits = 0
+        self.handling = 0.0
+
+    def hit(self, filename, lineno, when):
+        entry = self.locations.get((filename, lineno))
+        if entry is None:
+            entry = self.locations[(filename, lineno)] = [0, 0.0, None, 0]
+        entry[0] += 1
+        entry[1] += when - self.last
+        self.last = when
+        self.hits += 1
+        self.current = entry
+
+    def depth(self, depth):
+        entry = self.current
+        if entry:
+            entry[2] = depth if entry[2] is None else min(entry[2], depth)
+            entry[3] = max(entry[3], depth)
+
+    def format(self):
+        elapsed = self.last - self.started
+        lines = [u'{hits} hits in {ms:.0f} ms, client handling {handling:.3f} ms per hit\n\n'.format(
+            hits=self.hits, ms=elapsed * 1000, handling=self.hits and self.handling / self.hits * 1000)]
+        lines.append(u'{hits:>8} {share:>6} {gap:>12}  {depth:>7}  location\n'.format(
+            hits='hits', share='share', gap='avg gap ms', depth='depth'))
+        ranked = sorted(self.locations.items(), key=lambda item: item[1][0], reverse=True)
+        for (filename, lineno), (hits, gap, low, high) in ranked:
+            if low is None:
+                depth = '?'
+            elif low == high:
+                depth = str(low)
             else:
-                self.connected = False
-                self.listening = False
+                depth = '{low}-{high}'.format(low=low, high=high)
+            lines.append(u'{hits:>8} {share:>5.1f}% {gap:>12.3f}  {depth:>7}  {filename}:{lineno}\n'.format(
+                hits=hits, share=100.0 * hits / self.hits, gap=gap / hits * 1000, depth=depth,
+                filename=filename, lineno=lineno))
+        return u''.join(lines)
+
+
+class ContextData(object):
+    '''
+    The flattened variables of the current break, name : Property.
+
+    Names are kept sorted, so a variable and all its children are one
+    bisect away instead of a scan over every name. It is built once per
+    render of the context and shared by all views.
+    '''
+    def __init__(self, items=()):
+        self.data = dict(items)
+        self.names = sorted(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, name):
+        return name in self.data
 
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def children(self, name):
+        '''
+        Yield (name, Property) for name and everything nested in it
+        '''
+        if name in self.data:
+            yield name, self.data[name]
+        names = self.names
+        # One range per separator, siblings such as $v10 for $v1 lie
+        # between them and are never visited
+        for prefix in (name + '->', name + '::', name + '['):
+            i = bisect.bisect_left(names, prefix)
+            while i < len(names) and names[i].startswith(prefix):
+                yield names[i], self.data[names[i]]
+                i += 1
+
+
+class BreakpointStore(object):
+    '''
+    Breakpoint rows of one project, saved as a JSON index of
+    path : [row, ...]. Rows with a condition or hit count are saved as
+    [row, options].
+
+    The index is read when the first file of the project is opened and
+    written at most once per save delay, however many breakpoints change.
+    '''
+    delay = 1000
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = None
+        self.pending = 0
+
+    def load(self):
+        if self.files is None:
             try:
-                serv.close()
-                serv = None
-            except:
-                pass
-            return self.sock
+                f = open(self.filename)
+                try:
+                    self.files = json.load(f)
+                finally:
+                    f.close()
+            except (IOError, ValueError):
+                self.files = {}
+        return self.files
+
+    def get(self, path):
+        return self.load().get(path, [])
+
+    def set(self, path, rows):
+        files = self.load()
+        if files.get(path, []) == rows:
+            return
+        if rows:
+            files[path] = rows
         else:
-            raise ProtocolConnectionException('Could not create socket')
+            del files[path]
+        self.pending += 1
+        pending = self.pending
+        sublime.set_timeout(lambda: pending == self.pending and self.save(), self.delay)
+
+    def save(self):
+        try:
+            folder = os.path.dirname(self.filename)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            f = open(self.filename, 'w')
+            try:
+                json.dump(self.files, f, separators=(',', ':'))
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            sublime.status_message('Xdebug: Could not save breakpoints: {error}'.format(error=e))
+
+
+class PathMapping(object):
+    '''
+    Translate file URIs of the engine to local paths and back, for code
+    that runs under another root than the local copy, as in a container.
+
+    mapping is a dictionary of remote path : local path. Translations are
+    cached, each file is resolved on the filesystem once.
+    '''
+    drive = re.compile(r'/[A-Za-z]:')
+
+    def __init__(self, mapping):
+        self.key = sorted(mapping.items())
+        # Local roots are resolved like the files they are compared with,
+        # a symlinked or ~ root matches the real path of its files
+        pairs = [(remote.rstrip('/'), os.path.realpath(os.path.expanduser(local)).rstrip('/\\'))
+                 for remote, local in self.key]
+        # Longest prefix first, nested roots win over their parents
+        self.remotes = sorted(pairs, key=lambda pair: len(pair[0]), reverse=True)
+        self.locals = sorted([(remote, os.path.normcase(local)) for remote, local in pairs],
+                             key=lambda pair: len(pair[1]), reverse=True)
+        self.local_paths = {}
+        self.remote_uris = {}
+
+    def local(self, uri):
+        '''
+        The resolved local path of a file URI, None for other transports
+        '''
+        if uri in self.local_paths:
+            return self.local_paths[uri]
+        path = None
+        transport, _, filename = uri.partition('://')  # scheme:///path/file => scheme, /path/file
+        if transport == 'file' and filename:
+            filename = urllib.unquote(filename)
+            if self.drive.match(filename):
+                filename = filename[1:]  # /C:/path/file => C:/path/file
+            if not isinstance(filename, unicode):
+                filename = filename.decode('utf-8', 'replace')
+            for remote, local in self.remotes:
+                if filename == remote or filename.startswith(remote + '/'):
+                    filename = local + filename[len(remote):].replace('/', os.sep)
+                    break
+            path = os.path.realpath(filename)
+        self.local_paths[uri] = path
+        return path
+
+    def remote(self, filename):
+        '''
+        The file URI the engine knows a local file by
+        '''
+        if filename in self.remote_uris:
+            return self.remote_uris[filename]
+        path = os.path.realpath(filename)
+        key = os.path.normcase(path)  # C:\Proj and c:\proj are one folder on Windows
+        for remote, local in self.locals:
+            if key == local or key.startswith(local + os.sep):
+                path = remote + path[len(local):].replace(os.sep, '/')
+                break
+        else:
+            path = path.replace(os.sep, '/')
+        if not path.startswith('/'):
+            # C:/path/file => file:///C:/path/file, the form local expects
+            path = '/' + path
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        uri = self.remote_uris[filename] = 'file://' + urllib.quote(path, '/:')
+        return uri
 
 
 class XdebugView(object):
@@ -168,58 +1496,208 @@ class XdebugView(object):
     '''
     def __init__(self, view):
         self.view = view
+        self.filename = view.file_name()
         self.current_line = None
-        self.context_data = {}
         self.breaks = {}  # line : meta { id: bleh }
+        self.regions = {}  # line : gutter region, dropped when the text changes
+        self.drawn = []  # lines in the order of the drawn gutter regions
+        self.dirty = False
+        self.store = None
 
     def __getattr__(self, attr):
-        if hasattr(self.view, attr):
-            return getattr(self.view, attr)
-        if attr.startswith('on_'):
-            return self
-        raise(AttributeError, "%s does not exist" % attr)
-
-    def __call__(self, *args, **kwargs):
-        pass
+        return getattr(self.view, attr)
 
     def center(self, lineno):
         line = self.lines(lineno)[0]
         self.view.show_at_center(line)
 
-    def add_breakpoint(self, row):
-        if not row in self.breaks:
-            self.breaks[row] = {}
-            if protocol and protocol.connected:
-                protocol.send('breakpoint_set', t='line', f=self.uri(), n=row)
-                res = protocol.read().firstChild
-                self.breaks[row]['id'] = res.getAttribute('id')
-
-    def del_breakpoint(self, row):
-        if row in self.breaks:
-            if protocol and protocol.connected:
-                protocol.send('breakpoint_remove', d=self.breaks[row]['id'])
+    def add_breakpoint(self, row, options=None):
+        self.add_breakpoints([row], options)
+
+    def add_breakpoints(self, rows, options=None):
+        '''
+        Set breakpoints on rows in every session, one write per session.
+
+        options may hold a condition expression and a hit_value with its
+        hit_condition, the engine checks them and only breaks when they hold.
+        '''
+        rows = [row for row in rows if row not in self.breaks]
+        if not rows:
+            return
+        for row in rows:
+            self.breaks[row] = dict(options or {}, ids={})
+        self.dirty = True
+        self.save_breakpoints()
+        for session in sessions():
+            started = session.join_batch()
+            try:
+                for row in rows:
+                    self.breakpoint_set(session, row)
+            finally:
+                session.end_batch(started)
+
+    def set_breakpoints(self, rows, options):
+        '''
+        Replace the breakpoints on rows with ones using options
+        '''
+        self.del_breakpoints(rows)
+        self.add_breakpoints(rows, options)
+
+    def breakpoint_set(self, session, row, callback=None):
+        meta = self.breaks[row]
+        kwargs = {'t': 'line', 'f': self.uri(), 'n': row}
+        if meta.get('condition'):
+            kwargs['t'] = 'conditional'
+            kwargs['data'] = meta['condition'].encode('utf-8')
+        if meta.get('hit_value'):
+            kwargs['h'] = meta['hit_value']
+            kwargs['o'] = meta.get('hit_condition') or '>='
+        session.send('breakpoint_set', callback=lambda res: self.breakpoint_added(session, row, res, callback), **kwargs)
+
+    def breakpoint_added(self, session, row, res, callback=None):
+        '''
+        Store the id of a breakpoint, or remove it if it was toggled off
+        while breakpoint_set was in flight
+        '''
+        if res.error_code is not None:
+            sublime.status_message('Xdebug: Could not set breakpoint on line {row}: {message}'.format(row=row, message=res.error_message))
+        elif row in self.breaks:
+            self.breaks[row]['ids'][session.id] = res.id
+        elif res.id:
+            session.send('breakpoint_remove', d=res.id, callback=breakpoint_removed)
+        if callback:
+            callback(res)
+
+    def del_breakpoint(self, row, counter=None):
+        self.del_breakpoints([row], counter)
+
+    def del_breakpoints(self, rows, counter=None):
+        '''
+        Remove breakpoints on rows from every session, one write per
+        session. Replies are counted by counter when given.
+        '''
+        rows = [row for row in rows if row in self.breaks]
+        if not rows:
+            return
+        for session in sessions():
+            started = session.join_batch()
+            try:
+                for row in rows:
+                    id = self.breaks[row]['ids'].get(session.id)
+                    if id is not None:
+                        callback = counter.wrap(breakpoint_removed) if counter else breakpoint_removed
+                        session.send('breakpoint_remove', d=id, callback=callback)
+            finally:
+                session.end_batch(started)
+        for row in rows:
             del self.breaks[row]
+            self.regions.pop(row, None)
+        self.dirty = True
+        self.save_breakpoints()
 
-    def view_breakpoints(self):
-        self.view.add_regions('xdebug_breakpoint', self.lines(self.breaks.keys()), get_setting('breakpoint_scope'), breakpoint_icon, sublime.HIDDEN)
+    def move_breakpoints(self, moved):
+        '''
+        Move breakpoints to the lines their gutter regions moved to. The
+        engine cannot move a breakpoint, each one is removed and set again.
+        '''
+        metas = [(row, self.breaks.pop(old)) for old, row in moved]
+        rows = []
+        for row, meta in metas:
+            if row not in self.breaks:
+                self.breaks[row] = meta
+                rows.append(row)
+        for session in sessions():
+            started = session.join_batch()
+            try:
+                for row, meta in metas:
+                    id = meta['ids'].pop(session.id, None)
+                    if id is not None:
+                        session.send('breakpoint_remove', d=id, callback=breakpoint_removed)
+                for row in rows:
+                    self.breakpoint_set(session, row)
+            finally:
+                session.end_batch(started)
+        self.dirty = True
+        self.save_breakpoints()
 
-    def breakpoint_init(self):
-        if not self.breaks:
+    def view_breakpoints(self):
+        '''
+        Redraw the breakpoint gutter if breakpoints changed since the last
+        redraw. Only rows without a cached region are looked up.
+        '''
+        if not self.dirty or not self.view:
             return
-        uri = self.uri()
+        self.dirty = False
+        regions = self.regions
+        for row in self.breaks:
+            if row not in regions:
+                regions[row] = self.view.line(self.view.text_point(row - 1, 0))
+        self.drawn = sorted(self.breaks)
+        self.view.add_regions('xdebug_breakpoint', [regions[row] for row in self.drawn], get_setting('breakpoint_scope'), breakpoint_icon, sublime.HIDDEN)
+
+    def breakpoint_init(self, session, counter=None):
+        '''
+        Send breakpoint_set for every breakpoint to a new session, replies
+        are counted by counter when given
+        '''
         for row in self.breaks:
-            protocol.send('breakpoint_set', t='line', f=uri, n=row)
-            res = protocol.read().firstChild
-            self.breaks[row]['id'] = res.getAttribute('id')
+            self.breakpoint_set(session, row, counter.wrap() if counter else None)
 
-    def breakpoint_clear(self):
-        if not self.breaks:
+    def breakpoint_clear(self, counter=None):
+        self.del_breakpoints(self.breaks.keys(), counter)
+
+    def on_modified(self):
+        if self.regions:
+            self.regions.clear()
+        if self.breaks and not self.dirty:
+            self.track_breakpoints()
+
+    def track_breakpoints(self):
+        '''
+        Follow breakpoints whose lines moved with an edit, Sublime keeps
+        the gutter regions anchored to the text
+        '''
+        regions = self.view.get_regions('xdebug_breakpoint')
+        if len(regions) != len(self.drawn):
+            return
+        moved = []
+        for old, region in zip(self.drawn, regions):
+            row = self.view.rowcol(region.begin())[0] + 1
+            if row != old:
+                moved.append((old, row))
+        if moved:
+            self.move_breakpoints(moved)
+            self.view_breakpoints()
+
+    def restore_breakpoints(self):
+        '''
+        Load the saved breakpoints of this file, once it is open in a
+        window and done loading
+        '''
+        if self.store or not get_setting('save_breakpoints'):
+            return
+        window = self.view.window()
+        if not window or not self.view.file_name() or self.view.is_loading():
             return
-        for row in self.breaks.keys():
-            self.del_breakpoint(row)
+        self.store = breakpoint_store(window)
+        entries = self.store.get(os.path.realpath(self.view.file_name()))
+        if entries:
+            self.add_breakpoints([entry for entry in entries if not isinstance(entry, list)])
+            for entry in entries:
+                if isinstance(entry, list):
+                    self.add_breakpoint(*entry)
+            self.view_breakpoints()
+
+    def save_breakpoints(self):
+        if self.store:
+            entries = []
+            for row in sorted(self.breaks):
+                options = dict((key, value) for key, value in self.breaks[row].items() if key != 'ids')
+                entries.append([row, options] if options else row)
+            self.store.set(os.path.realpath(self.filename), entries)
 
     def uri(self):
-        return 'file://' + os.path.realpath(self.view.file_name())
+        return get_path_mapping().remote(self.filename)
 
     def lines(self, data=None):
         lines = []
@@ -252,7 +1730,19 @@ class XdebugView(object):
             self.view.end_edit(edit)
         return edit
 
+    def on_close(self):
+        '''
+        Let go of the closed view. The breakpoints stay set in the sessions,
+        see forget_view.
+        '''
+        self.view = None
+        self.regions.clear()
+        self.drawn = []
+        self.dirty = True
+
     def on_load(self):
+        self.restore_breakpoints()
+        self.view_breakpoints()
         if self.current_line:
             self.current(self.current_line)
             self.current_line = None
@@ -264,47 +1754,56 @@ class XdebugView(object):
         region = self.lines(line)
         icon = current_icon
 
-        if line in self.breaks.keys():
+        if line in self.breaks:
             icon = current_breakpoint_icon
 
         self.add_regions('xdebug_current_line', region, get_setting('current_line_scope'), icon, sublime.HIDDEN)
         self.center(line)
 
-    def add_context_data(self, propName, propType, propData):
-        '''
-        Store context data
-        '''
-        self.context_data[propName] = {'type': propType, 'data': propData}
-
     def on_selection_modified(self):
         '''
         Show selected variable in an output panel when clicked
         '''
-        if protocol and protocol.connected and self.context_data:
-            data = ''
+        if self.view.name() == 'Xdebug Stack':
+            self.select_frame()
+            return
+        if protocol and protocol.connected and context_data:
             point = self.view.sel()[0].a
             var_name = self.view.substr(self.view.word(point))
             if not var_name.startswith('$'):
                 var_name = '$' + var_name
-            is_variable = sublime.score_selector(self.view.scope_name(point), 'variable')
-
-            if is_variable and var_name in self.context_data:
-                kind = self.context_data[var_name]['type']
-                if kind == 'array' or kind == 'object':
-                    for key in sorted(self.context_data.keys()):
-                        if key.startswith(var_name):
-                            data += '{k} ({t}) = {d}\n'.format(k=key, t=self.context_data[key]['type'], d=self.context_data[key]['data'])
-                else:
-                    data += '{k} ({t}) = {d}\n'.format(k=var_name, t=kind, d=self.context_data[var_name]['data'])
+            if var_name not in context_data:
+                return
+            if not sublime.score_selector(self.view.scope_name(point), 'variable'):
+                return
+
+            data = u''
+            kind = context_data[var_name].type
+            prop = protocol.variables and protocol.variables.get(var_name)
+            if prop and not prop.pages:
+                protocol.variables.fetch(prop, self.inspect_loaded)
+            if kind == 'array' or kind == 'object':
+                for key, prop in context_data.children(var_name):
+                    data += u'{k} ({t}) = {d}\n'.format(k=key, t=prop.type, d=shown_value(prop))
+            else:
+                data += u'{k} ({t}) = {d}\n'.format(k=var_name, t=kind, d=shown_value(context_data[var_name]))
+
+            show_output(self.view.window(), 'xdebug_inspect', data)
+
+    def select_frame(self):
+        '''
+        Switch to the stack frame on the selected line of the stack view
+        '''
+        if not (protocol and protocol.connected and protocol.frames):
+            return
+        line = self.view.substr(self.view.line(self.view.sel()[0].a))
+        level = line.split(':', 1)[0].strip()
+        if level.isdigit() and int(level) != protocol.depth and int(level) < len(protocol.frames):
+            select_frame(protocol, int(level))
 
-            window = self.view.window()
-            if window:
-                output = window.get_output_panel('xdebug_inspect')
-                edit = output.begin_edit()
-                output.erase(edit, sublime.Region(0, output.size()))
-                output.insert(edit, 0, data)
-                output.end_edit(edit)
-                window.run_command('show_panel', {"panel": 'output.xdebug_inspect'})
+    def inspect_loaded(self, prop):
+        show_context()
+        self.on_selection_modified()
 
 
 class XdebugListenCommand(sublime_plugin.TextCommand):
@@ -312,55 +1811,189 @@ class XdebugListenCommand(sublime_plugin.TextCommand):
     Start listening for Xdebug connections
     '''
     def run(self, edit):
-        global protocol
-        protocol = Protocol()
-
-        threading.Thread(target=self.thread_callback).start()
+        global server, script_output
+        server = Server()
+        server.listening = True
+        script_output = ScriptOutput(get_setting('output_size') or 1000000, get_setting('output_delay') or 100)
 
-    def thread_callback(self):
-        protocol.accept()
-        if protocol and protocol.connected:
-            sublime.set_timeout(self.gui_callback, 0)
+        threading.Thread(target=server.listen, args=(self.gui_callback, self.close_callback)).start()
 
-    def gui_callback(self):
-        sublime.status_message('Xdebug: Connected')
-        init = protocol.read().firstChild
-        uri = init.getAttribute('fileuri')
+    def gui_callback(self, session, init):
+        sublime.status_message('Xdebug: Connected session {id}'.format(id=session.id))
+        session.fileuri = init.fileuri
         #show_file(self.view.window(), uri)
+        if not protocol:
+            activate(session)
+
+        # Every breakpoint_set and the first run go out in one write, the
+        # engine handles them in order so run waits for the breakpoints
+        counter = ReplyCounter('Xdebug: Set {count} breakpoints in {ms:.0f} ms')
+        session.start_batch()
+        try:
+            for feature in ('max_children', 'max_depth', 'max_data'):
+                value = get_project_setting(feature) or get_setting(feature)
+                if value:
+                    session.send('feature_set', n=feature, v=value)
+            # 1 copies script output to the Output panel, 2 only sends it here
+            capture = get_setting('output')
+            if capture:
+                script_output.shown = False
+                session.send('stdout', c=capture)
+                session.send('stderr', c=capture)
+            for view in breakpoint_views():
+                view.breakpoint_init(session, counter)
+            for name in exception_breakpoints:
+                exception_breakpoint_set(session, name, counter.wrap())
+            self.view.run_command('xdebug_continue', {'state': 'run', 'session': session.id})
+        finally:
+            session.send_batch()
+
+    def close_callback(self, session):
+        sublime.status_message('Xdebug: Connection closed')
+        end_session(session)
+
+    def is_enabled(self):
+        if server:
+            return False
+        return True
+
+
+class XdebugClearAllBreakpointsCommand(sublime_plugin.TextCommand):
+    '''
+    Clear breakpoints in all open buffers
+    '''
+    def run(self, edit):
+        counter = ReplyCounter('Xdebug: Cleared {count} breakpoints in {ms:.0f} ms')
+        for session in sessions():
+            session.start_batch()
+        try:
+            for view in breakpoint_views():
+                if view.breaks:
+                    view.breakpoint_clear(counter)
+                    view.view_breakpoints()
+            closed_views.clear()
+            for name in exception_breakpoints.keys():
+                exception_breakpoint_remove(name, counter)
+        finally:
+            for session in sessions():
+                session.send_batch()
+
+
+class XdebugSessionCommand(sublime_plugin.TextCommand):
+    '''
+    Switch between connected debugging sessions
+    '''
+    def run(self, edit):
+        self.sessions = sessions()
+        items = []
+        for session in self.sessions:
+            if session.location:
+                where = '{file}:{line}'.format(file=session.location[0], line=session.location[1])
+            else:
+                where = 'running'
+            active = ' (active)' if session is protocol else ''
+            items.append(['Session {id}{active}'.format(id=session.id, active=active), session.fileuri, where])
+        self.view.window().show_quick_panel(items, self.callback)
+
+    def callback(self, index):
+        if index == -1:
+            return
+        session = self.sessions[index]
+        if session.connected:
+            activate(session)
+
+    def is_enabled(self):
+        if sessions():
+            return True
+        return False
+
+
+class XdebugBreakpointCommand(sublime_plugin.TextCommand):
+    '''
+    Toggle a breakpoint, or set one that only breaks when condition is
+    true or its hit count matches
+    '''
+    def run(self, edit, condition=None, hit_value=None, hit_condition=None):
+        view = lookup_view(self.view)
+        rows = set(view.rows(view.lines()))
+        if condition or hit_value:
+            options = {}
+            if condition:
+                options['condition'] = condition
+            if hit_value:
+                options['hit_value'] = int(hit_value)
+                options['hit_condition'] = hit_condition or '>='
+            view.set_breakpoints(list(rows), options)
+            view.view_breakpoints()
+            return
+        added = [row for row in rows if row not in view.breaks]
+        view.del_breakpoints([row for row in rows if row in view.breaks])
+        view.add_breakpoints(added)
+        view.view_breakpoints()
 
-        for view in buffers.values():
-            view.breakpoint_init()
 
-        self.view.run_command('xdebug_continue', {'state': 'run'})
+class XdebugConditionalBreakpointCommand(sublime_plugin.TextCommand):
+    '''
+    Set a breakpoint that only breaks when a PHP expression is true
+    '''
+    def run(self, edit):
+        view = lookup_view(self.view)
+        rows = view.rows(view.lines())
+        meta = view.breaks.get(rows[0]) or {}
+        self.view.window().show_input_panel('Xdebug Break When', meta.get('condition') or '',
+            self.on_done, None, None)
 
-    def is_enabled(self):
-        if protocol:
-            return False
-        return True
+    def on_done(self, condition):
+        if condition.strip():
+            self.view.run_command('xdebug_breakpoint', {'condition': condition.strip()})
 
 
-class XdebugClearAllBreakpointsCommand(sublime_plugin.TextCommand):
+class XdebugHitBreakpointCommand(sublime_plugin.TextCommand):
     '''
-    Clear breakpoints in all open buffers
+    Set a breakpoint that only breaks on some hits: "5000" or ">= 5000"
+    breaks from the 5000th hit on, "== 5000" on that hit only and "% 10"
+    on every 10th hit
     '''
+    conditions = ('>=', '==', '%')
+
     def run(self, edit):
-        for view in buffers.values():
-            view.breakpoint_clear()
-            view.view_breakpoints()
+        self.view.window().show_input_panel('Xdebug Break On Hit', '>= ',
+            self.on_done, None, None)
+
+    def on_done(self, line):
+        line = line.strip()
+        condition = '>='
+        for operator in self.conditions:
+            if line.startswith(operator):
+                condition, line = operator, line[len(operator):].strip()
+                break
+        if not line.isdigit() or not int(line):
+            sublime.status_message('Xdebug: Hit count must be a number above 0')
+            return
+        self.view.run_command('xdebug_breakpoint', {'hit_value': int(line), 'hit_condition': condition})
 
 
-class XdebugBreakpointCommand(sublime_plugin.TextCommand):
+class XdebugExceptionBreakpointCommand(sublime_plugin.TextCommand):
     '''
-    Toggle a breakpoint
+    Toggle breaking when an exception of the given class is thrown, "*"
+    breaks on every exception
     '''
     def run(self, edit):
-        view = lookup_view(self.view)
-        for row in view.rows(view.lines()):
-            if row in view.breaks:
-                view.del_breakpoint(row)
-            else:
-                view.add_breakpoint(row)
-        view.view_breakpoints()
+        self.view.window().show_input_panel('Xdebug Break On Exception', 'Exception',
+            self.on_done, None, None)
+
+    def on_done(self, name):
+        name = name.strip()
+        if not name:
+            return
+        if name in exception_breakpoints:
+            exception_breakpoint_remove(name)
+            sublime.status_message('Xdebug: No longer breaking on ' + name)
+        else:
+            exception_breakpoints[name] = {}
+            for session in sessions():
+                exception_breakpoint_set(session, name)
+            sublime.status_message('Xdebug: Breaking on ' + name)
 
 
 class XdebugCommand(sublime_plugin.TextCommand):
@@ -370,20 +2003,39 @@ class XdebugCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         mapping = {
             'xdebug_breakpoint': 'Add/Remove Breakpoint',
+            'xdebug_conditional_breakpoint': 'Add Conditional Breakpoint',
+            'xdebug_hit_breakpoint': 'Add Hit Count Breakpoint',
+            'xdebug_exception_breakpoint': 'Break on Exception',
             'xdebug_clear_all_breakpoints': 'Clear all Breakpoints',
         }
 
-        if protocol:
+        if server:
             mapping['xdebug_clear'] = 'Stop debugging'
         else:
             mapping['xdebug_listen'] = 'Start debugging'
 
+        if len(sessions()) > 1:
+            mapping['xdebug_session'] = 'Switch Session'
+
+        mapping['xdebug_watch'] = 'Add/Remove Watch'
+        mapping['xdebug_replay'] = 'Replay Session'
+        mapping['xdebug_trace'] = 'Stop Trace' if trace else 'Start Trace'
+        if XdebugTraceCommand.last:
+            mapping['xdebug_trace_export'] = 'Export Trace'
+
         if protocol and protocol.connected:
             mapping.update({
                 'xdebug_status': 'Status',
                 'xdebug_execute': 'Execute',
             })
 
+        if protocol and protocol.location:
+            mapping['xdebug_evaluate'] = 'Evaluate'
+
+        if protocol and protocol.variables:
+            mapping['xdebug_expand'] = 'Expand Variable'
+            mapping['xdebug_open_value'] = 'Open Full Value'
+
         self.cmds = mapping.keys()
         self.items = mapping.values()
         self.view.window().show_quick_panel(self.items, self.callback)
@@ -395,7 +2047,7 @@ class XdebugCommand(sublime_plugin.TextCommand):
         command = self.cmds[index]
         self.view.run_command(command)
 
-        if protocol and command == 'xdebug_listen':
+        if server and command == 'xdebug_listen':
             url = get_project_setting('url')
             if url:
                 webbrowser.open(url + '?XDEBUG_SESSION_START=sublime.xdebug')
@@ -437,9 +2089,13 @@ class XdebugContinueCommand(sublime_plugin.TextCommand):
         'step_out': 'Step Out',
         'stop': 'Stop',
         'detach': 'Detach',
+        'stats': 'Run with Stats',
     }
 
-    def run(self, edit, state=None):
+    def run(self, edit, state=None, session=None):
+        self.session = server.get(session) if session else protocol
+        if not self.session:
+            return
         if not state or not state in self.states:
             self.view.window().show_quick_panel(self.states.values(), self.callback)
         else:
@@ -451,95 +2107,242 @@ class XdebugContinueCommand(sublime_plugin.TextCommand):
         if type(state) == int:
             state = self.states.keys()[state]
 
-        global xdebug_current
-        reset_current()
+        session = self.session
+        if session is protocol:
+            reset_current()
+        session.location = None
+        release_break(session)
+        if state == 'stats':
+            # Run through every breakpoint, recording hits instead of stopping
+            session.stats = HitStats()
+            state = 'run'
+            sublime.status_message('Xdebug: Running with stats')
+        session.send(state, callback=lambda res: self.state_callback(session, res))
+
+    def state_callback(self, session, res):
+        if res.filename:
+            #print '>>>break ' + res.filename + ':' + str(res.lineno)
+            session.location = (res.filename, res.lineno)
+
+        if res.status == 'break' and session.stats:
+            self.stats_callback(session, res)
+            return
 
-        protocol.send(state)
-        res = protocol.read().firstChild
-
-        for child in res.childNodes:
-            if child.nodeName == 'xdebug:message':
-                #print '>>>break ' + child.getAttribute('filename') + ':' + child.getAttribute('lineno')
-                sublime.status_message('Xdebug: breakpoint')
-                xdebug_current = show_file(self.view.window(), child.getAttribute('filename'))
-                xdebug_current.current(int(child.getAttribute('lineno')))
-
-        if (res.getAttribute('status') == 'break'):
-            # TODO stack_get
-            protocol.send('context_get')
-            res = protocol.read().firstChild
-            result = ''
-
-            def getValues(node):
-                result = unicode('')
-                for child in node.childNodes:
-                    if child.nodeName == 'property':
-                        propName = unicode(child.getAttribute('fullname'))
-                        propType = unicode(child.getAttribute('type'))
-                        propValue = None
-                        try:
-                            propValue = unicode(' '.join(base64.b64decode(t.data) for t in child.childNodes if t.nodeType == t.TEXT_NODE or t.nodeType == t.CDATA_SECTION_NODE))
-                        except:
-                            propValue = unicode(' '.join(t.data for t in child.childNodes if t.nodeType == t.TEXT_NODE or t.nodeType == t.CDATA_SECTION_NODE))
-                        if propName:
-                            if propName.lower().find('password') != -1:
-                                propValue = unicode('*****')
-                            result = result + unicode(propName + ' [' + propType + '] = ' + str(propValue) + '\n')
-                            result = result + getValues(child)
-                            if xdebug_current:
-                                xdebug_current.add_context_data(propName, propType, propValue)
-                return result
-
-            result = getValues(res)
-            add_debug_info('context', result)
-            if xdebug_current:
-                xdebug_current.on_selection_modified()
-
-            protocol.send('stack_get')
-            res = protocol.read().firstChild
-            result = unicode('')
-            for child in res.childNodes:
-                if child.nodeName == 'stack':
-                    propWhere = child.getAttribute('where')
-                    propLevel = child.getAttribute('level')
-                    propType = child.getAttribute('type')
-                    propFile = child.getAttribute('filename')
-                    propLine = child.getAttribute('lineno')
-                    result = result + unicode('{level:>3}: {type:<10} {where:<10} {filename}:{lineno}\n' \
-                                              .format(level=propLevel, type=propType, where=propWhere, lineno=propLine, filename=propFile))
-            add_debug_info('stack', result)
-
-        if res.getAttribute('status') == 'stopping' or res.getAttribute('status') == 'stopped':
-            self.view.run_command('xdebug_clear')
-            self.view.run_command('xdebug_listen')
+        if res.status == 'break':
+            first = session.first_break is None
+            if first:
+                session.first_break = time.time() - session.started
+            if session is protocol or not protocol or not protocol.location:
+                activate(session)
+                if first:
+                    sublime.status_message('Xdebug: breakpoint, {ms:.0f} ms after connecting'.format(ms=session.first_break * 1000))
+            else:
+                sublime.status_message('Xdebug: Session {id} stopped at {file}:{line}'.format(
+                    id=session.id, file=res.filename, line=res.lineno))
+
+        if res.status == 'stopping' or res.status == 'stopped':
+            end_session(session)
             sublime.status_message('Xdebug: Page finished executing. Reload to continue debugging.')
 
-    def is_enabled(self):
+    def stats_callback(self, session, res):
+        '''
+        Record a hit and carry on. The depth is asked for in the same write
+        as run, so each hit costs one round trip.
+        '''
+        stats = session.stats
+        received = time.time()
+        stats.hit(res.filename, res.lineno, received)
+        session.start_batch()
+        try:
+            session.send('stack_depth', callback=lambda res: stats.depth(int(res.get('depth') or 0)))
+            session.send('run', callback=lambda res: self.state_callback(session, res))
+        finally:
+            session.send_batch()
+        stats.handling += time.time() - received
+
+    def is_enabled(self, state=None, session=None):
         if protocol and protocol.connected:
             return True
-        if protocol:
+        if server:
             sublime.status_message('Xdebug: Waiting for executing to start')
             return False
         sublime.status_message('Xdebug: Not running')
         return False
 
 
+class XdebugExpandCommand(sublime_plugin.TextCommand):
+    '''
+    Load more children of the variable on the current line of the
+    Xdebug Context view, or under the cursor in a source file
+    '''
+    def run(self, edit):
+        prop = selected_property(self.view)
+        if not prop or not protocol.variables.fetch(prop, self.callback):
+            sublime.status_message('Xdebug: Nothing to expand')
+
+    def callback(self, prop):
+        show_context()
+
+    def is_enabled(self):
+        if protocol and protocol.connected and protocol.variables:
+            return True
+        return False
+
+
+class XdebugOpenValueCommand(sublime_plugin.TextCommand):
+    '''
+    Open the full value of a string cut short by max_data, from the
+    current line of the Xdebug Context view or under the cursor
+    '''
+    def run(self, edit):
+        prop = selected_property(self.view)
+        if not prop or not prop.truncated():
+            sublime.status_message('Xdebug: No truncated value to open')
+            return
+        ValueLoader(protocol, protocol.variables, prop, self.view.window()).start()
+
+    def is_enabled(self):
+        if protocol and protocol.connected and protocol.variables:
+            return True
+        return False
+
+
+class XdebugTraceCommand(sublime_plugin.TextCommand):
+    '''
+    Start tracing command timings, or stop and show them in the
+    Xdebug Trace panel
+    '''
+    last = None
+
+    def run(self, edit):
+        global trace
+        if not trace:
+            trace = Trace()
+            sublime.status_message('Xdebug: Tracing')
+            return
+
+        records, trace = trace, None
+        show_output(self.view.window(), 'xdebug_trace', records.format())
+        XdebugTraceCommand.last = records
+
+
+class XdebugTraceExportCommand(sublime_plugin.TextCommand):
+    '''
+    Write the last trace to a file as JSON lines
+    '''
+    def run(self, edit):
+        self.view.window().show_input_panel('Xdebug Trace File', os.path.expanduser('~/xdebug-trace.jsonl'),
+            self.on_done, None, None)
+
+    def on_done(self, filename):
+        XdebugTraceCommand.last.export(filename)
+        sublime.status_message('Xdebug: Trace written to ' + filename)
+
+    def is_enabled(self):
+        if XdebugTraceCommand.last:
+            return True
+        return False
+
+
+class XdebugWatchCommand(sublime_plugin.TextCommand):
+    '''
+    Add an expression to the watch list, or remove it if it is there
+    '''
+    def run(self, edit):
+        view = lookup_view(self.view)
+        selected = view.substr(view.sel()[0]) if view.sel() else ''
+        self.view.window().show_input_panel('Xdebug Watch', selected, self.on_done, None, None)
+
+    def on_done(self, expression):
+        expression = expression.strip()
+        if not expression:
+            return
+        if expression in watches:
+            watches.remove(expression)
+        else:
+            watches.append(expression)
+            if protocol and protocol.variables:
+                evaluate(protocol, expression, lambda res: watch_loaded(protocol))
+        if protocol and protocol.variables:
+            show_context()
+
+
+class XdebugEvaluateCommand(sublime_plugin.TextCommand):
+    '''
+    Evaluate a PHP expression at the current break
+    '''
+    def run(self, edit):
+        view = lookup_view(self.view)
+        selected = view.substr(view.sel()[0]) if view.sel() else ''
+        self.view.window().show_input_panel('Xdebug Evaluate', selected, self.on_done, None, None)
+
+    def is_enabled(self):
+        if protocol and protocol.location:
+            return True
+        return False
+
+    def on_done(self, expression):
+        expression = expression.strip()
+        if expression:
+            evaluate(protocol, expression, self.callback)
+
+    def callback(self, res):
+        if res.error_code is not None:
+            data = u'error: {message}\n'.format(message=res.error_message)
+        else:
+            data = get_values(res.properties, [], False)
+        show_output(self.view.window(), 'xdebug_inspect', data)
+
+
+class XdebugReplayCommand(sublime_plugin.TextCommand):
+    '''
+    Replay a recorded session, no PHP process is involved
+    '''
+    def run(self, edit):
+        folder = get_setting('record_path') or os.path.join(sublime.packages_path(), 'User', 'Xdebug', 'sessions')
+        logs = os.path.isdir(folder) and sorted(name for name in os.listdir(folder) if name.endswith('.dbgp'))
+        default = os.path.join(folder, logs[-1]) if logs else folder + os.sep
+        self.view.window().show_input_panel('Xdebug Replay Session', default, self.on_done, None, None)
+
+    def on_done(self, filename):
+        global server, script_output
+        try:
+            sock = ReplaySocket(filename)
+        except (IOError, ProtocolException), e:
+            sublime.status_message('Xdebug: Could not replay {file}: {error}'.format(file=filename, error=e))
+            return
+        if not server:
+            server = Server()
+        # Recorded script output is shown like live output
+        if not script_output:
+            script_output = ScriptOutput(get_setting('output_size') or 1000000, get_setting('output_delay') or 100)
+        listener = XdebugListenCommand(self.view)
+        server.add(sock, listener.gui_callback, listener.close_callback)
+
+
 class XdebugClearCommand(sublime_plugin.TextCommand):
     '''
     Close the socket and stop listening to xdebug
     '''
     def run(self, edit):
-        global protocol
+        global server, protocol, context_data
+        context_data = None
+        for view in breakpoint_views():
+            for meta in view.breaks.values():
+                meta['ids'] = {}
+        for name in exception_breakpoints:
+            exception_breakpoints[name] = {}
         try:
-            protocol.clear()
+            server.stop()
             reset_current()
         except:
             pass
         finally:
+            server = None
             protocol = None
 
     def is_enabled(self):
-        if protocol:
+        if server:
             return True
         return False
 
@@ -549,9 +2352,10 @@ class XdebugStatus(sublime_plugin.TextCommand):
     DBGp status command
     '''
     def run(self, edit):
-        protocol.send('status')
-        res = protocol.read().firstChild
-        sublime.status_message(res.getAttribute('reason') + ': ' + res.getAttribute('status'))
+        protocol.send('status', callback=self.callback)
+
+    def callback(self, res):
+        sublime.status_message(res.reason + ': ' + res.status)
 
     def is_enabled(self):
         if protocol and protocol.connected:
@@ -577,16 +2381,10 @@ class XdebugExecute(sublime_plugin.TextCommand):
             command, args = line.split(' ', 1)
         else:
             command, args = line, ''
-        protocol.send(command, args)
-        res = protocol.read().firstChild
+        protocol.send(command, args, callback=self.callback, raw=True)
 
-        window = self.view.window()
-        output = window.get_output_panel('xdebug_execute')
-        edit = output.begin_edit()
-        output.erase(edit, sublime.Region(0, output.size()))
-        output.insert(edit, 0, res.toprettyxml())
-        output.end_edit(edit)
-        window.run_command('show_panel', {"panel": 'output.xdebug_execute'})
+    def callback(self, res):
+        show_output(self.view.window(), 'xdebug_execute', res)
 
     def on_change(self, line):
         pass
@@ -596,38 +2394,45 @@ class XdebugExecute(sublime_plugin.TextCommand):
 
 
 class EventListener(sublime_plugin.EventListener):
-    def on_new(self, view):
-        lookup_view(view).on_new()
-
-    def on_clone(self, view):
-        lookup_view(view).on_clone()
-
+    '''
+    Pass view events on to XdebugViews. Events of views without
+    breakpoints or debug state return straight away, without looking up
+    or creating an XdebugView.
+    '''
     def on_load(self, view):
-        lookup_view(view).on_load()
+        global open_views
+        open_views = None
+        if view.buffer_id() in buffers or has_saved_breakpoints(view):
+            lookup_view(view).on_load()
 
-    def on_close(self, view):
-        lookup_view(view).on_close()
+    def on_activated(self, view):
+        if view.buffer_id() not in buffers and has_saved_breakpoints(view):
+            lookup_view(view)
 
-    def on_pre_save(self, view):
-        lookup_view(view).on_pre_save()
+    def on_close(self, view):
+        global open_views
+        open_views = None
+        if view.buffer_id() in buffers:
+            forget_view(view)
+        if view.id() in spill_files:
+            remove_file(spill_files.pop(view.id()))
 
     def on_post_save(self, view):
-        lookup_view(view).on_post_save()
+        # Save As renames the file
+        global open_views
+        open_views = None
+        if view.buffer_id() in buffers:
+            buffers[view.buffer_id()].filename = view.file_name()
 
     def on_modified(self, view):
-        lookup_view(view).on_modified()
+        xdebug_view = buffers.get(view.buffer_id())
+        if xdebug_view and xdebug_view.breaks:
+            xdebug_view.view = view
+            xdebug_view.on_modified()
 
     def on_selection_modified(self, view):
-        lookup_view(view).on_selection_modified()
-
-    def on_activated(self, view):
-        lookup_view(view).on_activated()
-
-    def on_deactivated(self, view):
-        lookup_view(view).on_deactivated()
-
-    def on_query_context(self, view, key, operator, operand, match_all):
-        lookup_view(view).on_query_context(key, operator, operand, match_all)
+        if protocol and (context_data or protocol.frames):
+            lookup_view(view).on_selection_modified()
 
 
 def lookup_view(v):
@@ -641,37 +2446,386 @@ def lookup_view(v):
         if id in buffers:
             buffers[id].view = v
         else:
-            buffers[id] = XdebugView(v)
+            closed = v.file_name() and closed_views.pop(os.path.realpath(v.file_name()), None)
+            if closed:
+                # Reopened, its breakpoints were never taken out of the sessions
+                closed.view = v
+                buffers[id] = closed
+                if not v.is_loading():
+                    closed.view_breakpoints()
+            else:
+                buffers[id] = XdebugView(v)
+                buffers[id].restore_breakpoints()
         return buffers[id]
     return None
 
 
+def forget_view(view):
+    '''
+    Drop the XdebugView of a buffer when its last view is closed. One
+    with breakpoints moves to closed_views, so closing a file does not
+    disarm its breakpoints, and is picked up again when it is reopened.
+    '''
+    global xdebug_current
+    id = view.buffer_id()
+    for window in sublime.windows():
+        for other in window.views():
+            if other.buffer_id() == id and other.id() != view.id():
+                return
+    xdebug_view = buffers.pop(id)
+    xdebug_view.on_close()
+    if xdebug_view.breaks and xdebug_view.filename:
+        closed_views[os.path.realpath(xdebug_view.filename)] = xdebug_view
+    if xdebug_current is xdebug_view:
+        xdebug_current = None
+
+
+def breakpoint_views():
+    '''
+    The XdebugViews of open files and of closed files with breakpoints
+    '''
+    return buffers.values() + closed_views.values()
+
+
+def remove_file(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def has_saved_breakpoints(view):
+    '''
+    Whether the file in view kept breakpoints when it was closed or has
+    some in the project store, the store is read the first time a file of
+    the project is asked about
+    '''
+    window = view.window()
+    if not window or not view.file_name():
+        return False
+    if os.path.realpath(view.file_name()) in closed_views:
+        return True
+    if not get_setting('save_breakpoints'):
+        return False
+    return bool(breakpoint_store(window).get(os.path.realpath(view.file_name())))
+
+
 def show_file(window, uri):
     '''
-    Open or focus a window
+    Open or focus the local file of a URI
     '''
+    global open_views
     if window:
         window.focus_group(0)
-    if sublime.platform() == 'windows':
-        transport, filename = uri.split(':///', 1)  # scheme:///C:/path/file => scheme, C:/path/file
+    filename = get_path_mapping().local(uri)
+    if not filename:
+        return None
+    if open_views is None:
+        open_views = {}
+        for w in sublime.windows():
+            for v in w.views():
+                if v.file_name():
+                    open_views.setdefault(os.path.realpath(v.file_name()), v)
+    view = open_views.get(filename)
+    if view and view.window():
+        view.window().focus_view(view)
+    elif os.path.exists(filename):
+        #view = window.open_file(filename, sublime.TRANSIENT)
+        view = sublime.active_window().open_file(filename)
+        open_views[filename] = view
     else:
-        transport, filename = uri.split('://', 1)  # scheme:///path/file => scheme, /path/file
-    if transport == 'file' and os.path.exists(filename):
-        window = sublime.active_window()
-        views = window.views()
-        found = False
-        for v in views:
-            if v.file_name():
-                path = os.path.realpath(v.file_name())
-                if path == os.path.realpath(filename):
-                    view = v
-                    window.focus_view(v)
-                    found = True
-                    break
-        if not found:
-            #view = window.open_file(filename, sublime.TRANSIENT)
-            view = window.open_file(filename)
-        return lookup_view(view)
+        return None
+    return lookup_view(view)
+
+
+def sessions():
+    '''
+    The connected debugging sessions
+    '''
+    if server:
+        return [session for session in server.sessions if session.connected]
+    return []
+
+
+def activate(session):
+    '''
+    Make session the one shown in the debug views and driven by the
+    commands, loading its context and stack when it is at a break
+    '''
+    global protocol, xdebug_current
+    reset_current()
+    protocol = session
+    if not session.location:
+        return
+    filename, lineno = session.location
+    sublime.status_message('Xdebug: breakpoint')
+    xdebug_current = show_file(sublime.active_window(), filename)
+    if xdebug_current:
+        xdebug_current.current(lineno)
+
+    if session.variables:
+        show_context()
+        if session.frames is not None:
+            show_stack()
+    else:
+        load_break(session)
+
+
+def load_break(session):
+    '''
+    Send every query needed at a break in one write and handle the
+    replies as they come in. The stack is asked for first, so its view
+    is drawn without waiting for the larger context replies.
+    '''
+    session.generation += 1
+    session.depth = 0
+    tree = session.variables = VariableTree(session)
+    session.frame_trees = {0: tree}
+    session.frame_order = [0]
+    session.superglobals = []
+    contexts = [0]
+    if get_setting('superglobals'):
+        contexts.append(1)
+    tree.loading = len(contexts)
+    session.start_batch()
+    try:
+        session.send('stack_get', callback=lambda res: stack_loaded(session, tree, res))
+        session.send('context_names', callback=lambda res: session.context_names.update(res.contexts))
+        for context in contexts:
+            session.send('context_get', c=context,
+                callback=lambda res, context=context: context_loaded(session, tree, context, res))
+        for expression in watches:
+            evaluate(session, expression, lambda res: watch_loaded(session))
+    finally:
+        session.send_batch()
+
+
+def release_break(session):
+    '''
+    Free the variables of the previous break before the session moves on
+    '''
+    global context_data
+    if session is protocol:
+        context_data = None
+    for tree in session.frame_trees.values():
+        tree.release()
+    for context, properties in session.superglobals:
+        release(properties)
+    for res in session.watches.values():
+        if isinstance(res, Response):
+            release(res.properties)
+    session.variables = None
+    session.frames = None
+    session.frame_trees = {}
+    session.frame_order = []
+    session.superglobals = []
+    session.watches = {}
+
+
+def evaluate(session, expression, callback):
+    '''
+    Evaluate a PHP expression at the current break. The reply is kept
+    until the session moves on, asking again costs no round trip.
+    '''
+    results = session.watches
+    res = results.get(expression)
+    if isinstance(res, Response):
+        callback(res)
+        return
+    if res is not None:
+        res.append(callback)
+        return
+
+    def evaluated(res):
+        if session.watches is not results:
+            return
+        for prop in walk(res.properties):
+            if not prop.fullname:
+                if not prop.parent:
+                    prop.fullname = expression
+                elif prop.parent.type == 'object':
+                    prop.fullname = u'{parent}->{name}'.format(parent=prop.parent.fullname, name=prop.name)
+                else:
+                    prop.fullname = u'{parent}[{name}]'.format(parent=prop.parent.fullname, name=prop.name)
+        callbacks = results[expression]
+        results[expression] = res
+        for callback in callbacks:
+            callback(res)
+    results[expression] = [callback]
+    session.send('eval', data=expression.encode('utf-8'), callback=evaluated)
+
+
+def watch_loaded(session):
+    '''
+    Render the watch list once every watch of the break has its result
+    '''
+    if session.variables:
+        context_ready(session)
+
+
+def select_frame(session, depth):
+    '''
+    Show the variables of another frame of the stack. Frames already
+    loaded during this break are shown from the cache.
+    '''
+    global xdebug_current
+    frame = session.frames[depth]
+    session.depth = depth
+    reset_current()
+    view = show_file(sublime.active_window(), frame.get('filename'))
+    if view:
+        view.current(int(frame.get('lineno') or 0))
+        xdebug_current = view
+
+    if depth in session.frame_order:
+        session.frame_order.remove(depth)
+    session.frame_order.append(depth)
+    tree = session.frame_trees.get(depth)
+    if tree:
+        session.variables = tree
+        show_context()
+        return
+
+    tree = session.variables = VariableTree(session, depth)
+    tree.loading = 1
+    session.frame_trees[depth] = tree
+    # Superglobals are the same in every frame, share those of the break
+    for context, properties in session.superglobals:
+        tree.add_context(context, properties)
+    session.send('context_get', c=0, d=depth,
+        callback=lambda res: context_loaded(session, tree, 0, res))
+
+
+def trim_frames(session):
+    '''
+    Drop the least recently shown frames while the cached variables are
+    over the frame_cache_size budget
+    '''
+    budget = get_setting('frame_cache_size')
+    if not budget:
+        return
+    total = sum(tree.size for tree in session.frame_trees.values())
+    for depth in list(session.frame_order):
+        if total <= budget:
+            break
+        if depth == session.depth:
+            continue
+        tree = session.frame_trees.pop(depth)
+        total -= tree.size
+        tree.release()
+        session.frame_order.remove(depth)
+
+
+def context_loaded(session, tree, context, res):
+    if tree.generation != session.generation:
+        return
+    tree.add_context(context, res.properties)
+    tree.loading -= 1
+    if context:
+        session.superglobals.append((context, res.properties))
+    trim_frames(session)
+    if session.variables is tree:
+        context_ready(session)
+
+
+def context_ready(session):
+    '''
+    Render the context once every context and watch reply of the break is
+    in. Each render formats all the variables, so one per break instead of
+    one per reply.
+    '''
+    if session is not protocol or session.variables.loading:
+        return
+    for res in session.watches.values():
+        if not isinstance(res, Response):
+            return
+    show_context()
+    if xdebug_current:
+        xdebug_current.on_selection_modified()
+
+
+def stack_loaded(session, tree, res):
+    if tree.generation != session.generation:
+        return
+    session.frames = res.frames
+    if session is protocol:
+        show_stack()
+
+
+def breakpoint_removed(res):
+    '''
+    Reply to breakpoint_remove, only errors are worth showing
+    '''
+    if res.error_code is not None:
+        sublime.status_message('Xdebug: Could not remove breakpoint: {message}'.format(message=res.error_message))
+
+
+def exception_breakpoint_set(session, name, callback=None):
+    def added(res):
+        if res.error_code is not None:
+            sublime.status_message('Xdebug: Could not break on {name}: {message}'.format(name=name, message=res.error_message))
+        elif name in exception_breakpoints:
+            exception_breakpoints[name][session.id] = res.id
+        elif res.id:
+            session.send('breakpoint_remove', d=res.id, callback=breakpoint_removed)
+        if callback:
+            callback(res)
+    session.send('breakpoint_set', t='exception', x=name, callback=added)
+
+
+def exception_breakpoint_remove(name, counter=None):
+    ids = exception_breakpoints.pop(name, {})
+    for session in sessions():
+        if session.id in ids:
+            callback = counter.wrap(breakpoint_removed) if counter else breakpoint_removed
+            session.send('breakpoint_remove', d=ids[session.id], callback=callback)
+
+
+def end_session(session):
+    '''
+    Forget a finished session, a session waiting at a break takes over
+    '''
+    global protocol
+    release_break(session)
+    if session.stats:
+        show_stats(session.stats)
+    if server:
+        server.remove(session)
+    else:
+        session.clear()
+    for view in breakpoint_views():
+        for meta in view.breaks.values():
+            meta['ids'].pop(session.id, None)
+    for ids in exception_breakpoints.values():
+        ids.pop(session.id, None)
+    if session is protocol:
+        reset_current()
+        protocol = None
+        for other in sessions():
+            if other.location:
+                activate(other)
+                break
+
+
+def show_stats(stats):
+    '''
+    Show the report of a Run with Stats in an output panel
+    '''
+    show_output(sublime.active_window(), 'xdebug_stats', stats.format())
+
+
+def show_output(window, name, text):
+    '''
+    Replace the text of the output panel name and show it
+    '''
+    if not window:
+        return
+    output = window.get_output_panel(name)
+    edit = output.begin_edit()
+    output.erase(edit, sublime.Region(0, output.size()))
+    output.insert(edit, 0, text)
+    output.end_edit(edit)
+    window.run_command('show_panel', {"panel": 'output.' + name})
 
 
 def reset_current():
@@ -706,6 +2860,31 @@ def get_project_setting(key):
         pass
 
 
+def breakpoint_store(window):
+    '''
+    Get the breakpoint store of the project open in window, projects are
+    told apart by their folders
+    '''
+    key = tuple(window.folders())
+    if key not in breakpoint_stores:
+        name = hashlib.md5('\n'.join(key).encode('utf-8')).hexdigest() if key else 'default'
+        filename = os.path.join(sublime.packages_path(), 'User', 'Xdebug', name + '.breakpoints')
+        breakpoint_stores[key] = BreakpointStore(filename)
+    return breakpoint_stores[key]
+
+
+def get_path_mapping():
+    '''
+    The PathMapping for the path_mapping setting, a project setting takes
+    precedence. Rebuilt only when the setting changes.
+    '''
+    global path_mapping
+    mapping = get_project_setting('path_mapping') or get_setting('path_mapping') or {}
+    if path_mapping is None or path_mapping.key != sorted(mapping.items()):
+        path_mapping = PathMapping(mapping)
+    return path_mapping
+
+
 def get_setting(key):
     '''
     Get Xdebug setting
@@ -715,12 +2894,167 @@ def get_setting(key):
         return s.get(key)
 
 
+def walk(properties):
+    '''
+    Yield properties and their loaded children depth first
+    '''
+    stack = [iter(properties)]
+    while stack:
+        for prop in stack[-1]:
+            yield prop
+            if prop.children:
+                stack.append(iter(prop.children))
+            break
+        else:
+            stack.pop()
+
+
+def release(properties):
+    '''
+    Break the parent and child links of a property tree
+    '''
+    for prop in list(walk(properties)):
+        prop.parent = None
+        prop.children = []
+
+
+def selected_property(view):
+    '''
+    The variable on the current line of the Xdebug Context view, or the
+    one under the cursor in a source file
+    '''
+    variables = protocol.variables
+    point = view.sel()[0].a
+    name = view.substr(view.line(point)).split(' [', 1)[0].strip()
+    prop = variables.get(name)
+    if not prop:
+        name = view.substr(view.word(point))
+        if not name.startswith('$'):
+            name = '$' + name
+        prop = variables.get(name)
+    return prop
+
+
+def shown_value(prop):
+    '''
+    The value of a property as shown to the user, passwords are masked
+    '''
+    if prop.fullname.lower().find('password') != -1:
+        return u'*****'
+    return prop.value
+
+
+def get_values(properties, items, loadable=True):
+    '''
+    Format variables for the context view, collecting (name, Property)
+    pairs in items for inspection.
+
+    Rows go to a list that is joined once. Past the context_limit setting
+    (in characters) rows are no longer written and a marker is added.
+    Rows of variables that are not loadable, such as watch results, do
+    not offer Expand or Open Full Value.
+    '''
+    limit = get_setting('context_limit')
+    rows = []
+    size = 0
+    skipped = 0
+    for prop in walk(properties):
+        propName = prop.fullname
+        if not propName:
+            continue
+        items.append((propName, prop))
+
+        if limit and size > limit:
+            skipped += 1
+            continue
+        propType = prop.type
+        propValue = shown_value(prop)
+        row = u'{name} [{type}] = {value}'.format(name=propName, type=propType, value=propValue)
+        if prop.truncated():
+            if loadable:
+                row += u'... ({n} bytes, Open Full Value to see all)'.format(n=prop.size)
+            else:
+                row += u'... ({n} bytes)'.format(n=prop.size)
+        if not prop.complete():
+            if loadable:
+                row += u' ({n} more, expand to load)'.format(n=prop.numchildren - len(prop.children))
+            else:
+                row += u' ({n} more)'.format(n=prop.numchildren - len(prop.children))
+        rows.append(row)
+        rows.append(u'\n')
+        size += len(row) + 1
+
+    if skipped:
+        rows.append(u'... truncated, {n} more variables\n'.format(n=skipped))
+    return u''.join(rows)
+
+
+def get_watches(session, items):
+    '''
+    Format the results of the watch expressions at the current break. Their
+    names are expressions, which property_get and property_value cannot
+    load more of.
+    '''
+    rows = []
+    for expression in watches:
+        res = session.watches.get(expression)
+        if not isinstance(res, Response):
+            rows.append(u'{expression} = ...\n'.format(expression=expression))
+        elif res.error_code is not None:
+            rows.append(u'{expression} = error: {message}\n'.format(expression=expression, message=res.error_message))
+        elif res.properties:
+            rows.append(get_values(res.properties, items, False))
+        else:
+            rows.append(u'{expression} =\n'.format(expression=expression))
+    return u''.join(rows)
+
+
+def show_context():
+    '''
+    Render the variables of the current break in the context view
+    '''
+    global context_data
+    items = []
+    parts = []
+    for context, properties in protocol.variables.contexts:
+        if context:
+            name = protocol.context_names.get(context) or 'Context {id}'.format(id=context)
+            parts.append(u'\n{name}:\n'.format(name=name))
+        parts.append(get_values(properties, items))
+    if watches:
+        parts.append(u'\nWatch:\n')
+        parts.append(get_watches(protocol, items))
+    add_debug_info('context', u''.join(parts))
+    context_data = ContextData(items)
+
+
+def show_stack():
+    '''
+    Render the stack of the current break in the stack view
+    '''
+    result = unicode('')
+    for frame in protocol.frames:
+        propWhere = frame.get('where', '')
+        propLevel = frame.get('level', '')
+        propType = frame.get('type', '')
+        propFile = frame.get('filename', '')
+        propLine = frame.get('lineno', '')
+        result = result + unicode('{level:>3}: {type:<10} {where:<10} {filename}:{lineno}\n' \
+                                  .format(level=propLevel, type=propType, where=propWhere, lineno=propLine, filename=propFile))
+    add_debug_info('stack', result)
+    # Park the cursor on the top frame, selecting a line switches frames
+    v = debug_panels['stack'][0]
+    v.sel().clear()
+    v.sel().add(sublime.Region(0))
+
+
 def add_debug_info(name, data):
     '''
     Adds data to the debug output windows
+
+    The views are remembered and only the lines that differ from the
+    previous update are replaced, changed context lines are highlighted.
     '''
-    found = False
-    v = None
     window = sublime.active_window()
 
     if name == 'context':
@@ -730,26 +3064,44 @@ def add_debug_info(name, data):
         group = 2
         fullName = "Xdebug Stack"
 
-    for v in window.views():
-        if v.name() == fullName:
-            found = True
-            break
+    v, lines = debug_panels.get(name, (None, None))
+    if not v or not v.window():
+        v, lines = None, None
+        for view in window.views():
+            if view.name() == fullName:
+                v = view
+                break
 
-    if not found:
+    if not v:
         v = window.new_file()
         v.set_scratch(True)
         v.set_read_only(True)
         v.set_name(fullName)
         v.settings().set('word_wrap', False)
-        found = True
 
-    if found:
-        v.set_read_only(False)
-        window.set_view_index(v, group, 0)
-        edit = v.begin_edit()
+    new_lines = data.splitlines(True)
+    changed = []
+    v.set_read_only(False)
+    window.set_view_index(v, group, 0)
+    edit = v.begin_edit()
+    if lines is None:
         v.erase(edit, sublime.Region(0, v.size()))
         v.insert(edit, 0, data)
-        v.end_edit(edit)
-        v.set_read_only(True)
+    else:
+        opcodes = difflib.SequenceMatcher(None, lines, new_lines).get_opcodes()
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            if tag == 'equal':
+                continue
+            begin = v.text_point(i1, 0) if i1 < len(lines) else v.size()
+            end = v.text_point(i2, 0) if i2 < len(lines) else v.size()
+            v.replace(edit, sublime.Region(begin, end), ''.join(new_lines[j1:j2]))
+            changed.extend(range(j1, j2))
+    v.end_edit(edit)
+    v.set_read_only(True)
+    debug_panels[name] = (v, new_lines)
+
+    if name == 'context':
+        regions = [v.line(v.text_point(row, 0)) for row in changed]
+        v.add_regions('xdebug_changed', regions, get_setting('changed_scope'), sublime.DRAW_OUTLINED)
 
     window.focus_group(0)
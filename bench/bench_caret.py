@@ -0,0 +1,76 @@
+'''
+Moving the caret over variables in a source file while stopped at a
+break with a large scope, and looking up a variable and its children in
+the ContextData store against the sorted scan it replaced. Besides
+arrays spread over the scope, $v4 is timed: thousands of names merely
+start with it, $v40 to $v49999, and none is a child.
+
+    python bench_caret.py [--moves N]
+'''
+import optparse
+
+import sublime
+from harness import Xdebug, best, connect, engine, forked, settle, table, timer
+
+
+def sorted_scan(data, name):
+    '''
+    The lookup before ContextData: sort every name, then test each one
+    '''
+    found = []
+    for key in sorted(data.keys()):
+        if key.startswith(name):
+            found.append((key, data[key]))
+    return found
+
+
+def caret(variables, moves):
+    session, fake = connect(engine.Scenario(variables=variables))
+    if not sublime.run_until(lambda: session.location, 60):
+        raise RuntimeError('No break after connecting')
+    settle(session)
+    context_data = Xdebug.context_data
+
+    view = sublime.active_window().active_view()
+    view.text = ''.join('    $v{i} = strlen($v{i});\n'.format(i=i) for i in range(variables))
+    # A step that is not a multiple of five lands on arrays too
+    rows = range(0, variables, variables // moves + 1)[:moves]
+    points = [view.text_point(row, 5) for row in rows]
+    listener = Xdebug.EventListener()
+
+    def move():
+        for point in points:
+            view.sel()[:] = [sublime.Region(point)]
+            listener.on_selection_modified(view)
+
+    # Arrays are the variables with children, one in five
+    arrays = ['$v{i}'.format(i=i) for i in rows if i % 5 == 4]
+    data = dict(context_data.data)
+    started = timer()
+    move()
+    return {
+        'names': len(context_data),
+        'event': (timer() - started) / len(points),
+        'children': best(lambda: [list(context_data.children(name)) for name in arrays]) / len(arrays),
+        'prefix': best(lambda: list(context_data.children('$v4')), number=10),
+        'scan': best(lambda: [sorted_scan(data, name) for name in arrays[:20]], repeat=3) / len(arrays[:20]),
+    }
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--moves', type='int', default=200, help='caret moves per measurement')
+    options, args = parser.parse_args()
+
+    rows = []
+    for variables in (1000, 10000, 50000):
+        result = forked(caret, variables, options.moves)
+        rows.append([variables, result['names'], result['event'] * 1000, result['children'] * 1e6,
+            result['prefix'] * 1e6, result['scan'] * 1000])
+    table('Caret moves over the variables of a break',
+        [('variables', '{0}'), ('names', '{0}'), ('event ms', '{0:.3f}'), ('children us', '{0:.1f}'),
+        ('$v4 us', '{0:.1f}'), ('sorted scan ms', '{0:.2f}')], rows)
+
+
+if __name__ == '__main__':
+    main()
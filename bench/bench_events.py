@@ -0,0 +1,100 @@
+'''
+The cost per keystroke of the view events with hundreds of open files,
+with EventListener and with the dispatch it replaced, which made an
+XdebugView for every view on its first event and resolved the missing
+on_* hooks through __getattr__.
+
+    python bench_events.py [--keys N]
+'''
+import optparse
+
+import sublime
+from harness import Xdebug, best, connect, engine, forked, settle, table
+
+
+class OldView(object):
+    def __init__(self, view):
+        self.view = view
+        self.current_line = None
+        self.context_data = {}
+        self.breaks = {}
+
+    def __getattr__(self, attr):
+        if hasattr(self.view, attr):
+            return getattr(self.view, attr)
+        if attr.startswith('on_'):
+            return self
+        raise AttributeError(attr)
+
+    def __call__(self, *args, **kwargs):
+        pass
+
+
+class OldListener(object):
+    def __init__(self):
+        self.buffers = {}
+
+    def lookup_view(self, view):
+        id = view.buffer_id()
+        if id not in self.buffers:
+            self.buffers[id] = OldView(view)
+        return self.buffers[id]
+
+    def on_modified(self, view):
+        self.lookup_view(view).on_modified()
+
+    def on_selection_modified(self, view):
+        self.lookup_view(view).on_selection_modified()
+
+
+def keystrokes(files, keys, debugging, old):
+    window = sublime.active_window()
+    views = []
+    for i in range(files):
+        view = window.open_file('/tmp/bench/src/file{i}.php'.format(i=i))
+        view.text = '<?php\n    $value = strlen($name);\n' + '\n' * 100
+        views.append(view)
+    # One file in ten has breakpoints
+    for view in views[::10]:
+        Xdebug.lookup_view(view).add_breakpoints([2, 5])
+    if debugging:
+        session, fake = connect(engine.Scenario(variables=1000))
+        if not sublime.run_until(lambda: session.location, 60):
+            raise RuntimeError('No break after connecting')
+        settle(session)
+    listener = old and OldListener() or Xdebug.EventListener()
+    order = [views[i * 7 % files] for i in range(keys)]
+
+    def type():
+        for view in order:
+            listener.on_modified(view)
+            listener.on_selection_modified(view)
+
+    seconds = best(type, repeat=3) / keys
+    buffers = old and listener.buffers or Xdebug.buffers
+    return {'seconds': seconds, 'buffers': len(buffers)}
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--keys', type='int', default=5000, help='keystrokes per measurement')
+    options, args = parser.parse_args()
+
+    rows = []
+    for debugging in (False, True):
+        for files in (100, 500):
+            new = forked(keystrokes, files, options.keys, debugging, False)
+            row = [debugging and 'yes' or 'no', files, new['seconds'] * 1e6, new['buffers'], None, None]
+            # At a break the old views inspected variables as well, which
+            # OldView does not do, so only the idle case compares
+            if not debugging:
+                old = forked(keystrokes, files, options.keys, debugging, True)
+                row[4:] = [old['seconds'] * 1e6, old['buffers']]
+            rows.append(row)
+    table('Keystrokes spread over open files, one in ten with breakpoints',
+        [('at a break', '{0}'), ('files', '{0}'), ('EventListener us', '{0:.2f}'), ('buffers', '{0}'),
+        ('old dispatch us', '{0:.2f}'), ('buffers', '{0}')], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+Formatting the context view for 10k and more variables with get_values,
+capped by context_limit and uncapped, and with the recursive string
+concatenation it replaced.
+
+    python bench_format.py [--log FILE]
+
+With --log the largest context_get reply of a session log is formatted.
+'''
+import base64
+import optparse
+from xml.dom.minidom import parseString
+
+import sublime
+from harness import Xdebug, best, engine, forked, table
+
+
+def concatenated(node):
+    '''
+    The formatter before get_values: strings added up at every level and
+    base64 tried on every value
+    '''
+    result = unicode('')
+    for child in node.childNodes:
+        if child.nodeName == 'property':
+            propName = unicode(child.getAttribute('fullname'))
+            propType = unicode(child.getAttribute('type'))
+            texts = [t.data for t in child.childNodes if t.nodeType == t.TEXT_NODE or t.nodeType == t.CDATA_SECTION_NODE]
+            try:
+                propValue = unicode(' '.join(base64.b64decode(text) for text in texts))
+            except:
+                propValue = unicode(' '.join(texts))
+            if propName:
+                result = result + unicode(propName + ' [' + propType + '] = ' + str(propValue) + '\n')
+                result = result + concatenated(child)
+    return result
+
+
+def largest_context(filename):
+    replies = [data for when, kind, data in Xdebug.read_records(filename)
+        if kind == Xdebug.Recorder.RECEIVED and 'command="context_get"' in data[:300]]
+    if not replies:
+        raise RuntimeError('No context_get reply in ' + filename)
+    return max(replies, key=len)
+
+
+def generated(variables):
+    scenario = engine.Scenario(variables=variables)
+    attributes, body = scenario.on_context_get({}, None)
+    return scenario.response('context_get', 1, attributes, body)
+
+
+def measure(data, old=True):
+    res = Xdebug.parse_response(data)
+    names = sum(1 for prop in Xdebug.walk(res.properties))
+    limit = sublime.settings.get('context_limit')
+    Xdebug.get_values(res.properties, [])
+    capped = best(lambda: Xdebug.get_values(res.properties, []), repeat=3)
+    sublime.settings['context_limit'] = 0
+    uncapped = best(lambda: Xdebug.get_values(res.properties, []), repeat=3)
+    sublime.settings['context_limit'] = limit
+    result = {'names': names, 'capped': capped, 'uncapped': uncapped, 'old': None}
+    if old:
+        document = parseString(data)
+        result['old'] = best(lambda: concatenated(document.firstChild), repeat=1)
+    return result
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--log', help='format the largest context of this session log')
+    options, args = parser.parse_args()
+
+    columns = [('names', '{0}'), ('capped ms', '{0:.1f}'), ('uncapped ms', '{0:.1f}'), ('concatenated ms', '{0:.1f}')]
+    if options.log:
+        result = forked(measure, largest_context(options.log))
+        table('Largest context of ' + options.log, columns,
+            [[result['names'], result['capped'] * 1000, result['uncapped'] * 1000, result['old'] * 1000]])
+        return
+
+    rows = []
+    for variables in (10000, 50000, 100000):
+        result = forked(measure, generated(variables), variables <= 50000)
+        rows.append([variables, result['names'], result['capped'] * 1000, result['uncapped'] * 1000,
+            result['old'] and result['old'] * 1000])
+    table('Context view text, context_limit {limit} characters'.format(limit=sublime.settings.get('context_limit')),
+        [('variables', '{0}')] + columns, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+Reading length prefixed frames of a few KiB to many MiB over a socket
+pair, with the receive buffer of Protocol and with the string reader it
+replaced.
+
+    python bench_framing.py [--count N]
+'''
+import optparse
+import socket
+import threading
+
+from harness import Xdebug, forked, table, timer
+
+
+class StringReader(object):
+    '''
+    The reader before the receive buffer: the unread bytes are one string
+    that every recv is added to and every frame split off
+    '''
+    read_rate = 1024
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ''
+
+    def read_until_null(self):
+        while not '\x00' in self.buffer:
+            self.buffer += self.sock.recv(self.read_rate)
+        data, self.buffer = self.buffer.split('\x00', 1)
+        return data
+
+    def read_data(self):
+        length = self.read_until_null()
+        message = self.read_until_null()
+        if int(length) != len(message):
+            raise Xdebug.ProtocolException('Length mismatch')
+        return message
+
+
+def frame(xml):
+    return '{length}\x00{xml}\x00'.format(length=len(xml), xml=xml)
+
+
+def write(sock, packet, count):
+    try:
+        for i in range(count):
+            sock.sendall(packet)
+    except EnvironmentError:
+        pass
+
+
+def read(reader, size, count):
+    ours, theirs = socket.socketpair()
+    packet = frame('<response>' + 'x' * (size - len('<response></response>')) + '</response>')
+    writer = threading.Thread(target=write, args=(theirs, packet, count))
+    writer.daemon = True
+    writer.start()
+    reader = reader(ours)
+    started = timer()
+    for i in range(count):
+        if len(reader.read_data()) != size:
+            raise RuntimeError('Short frame')
+    elapsed = timer() - started
+    writer.join()
+    ours.close()
+    theirs.close()
+    return {'rate': size * count / elapsed}
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--count', type='int', default=10, help='frames per measurement')
+    options, args = parser.parse_args()
+
+    read_rate = Xdebug.get_setting('read_rate')
+    readers = [
+        ('Protocol', lambda sock: Xdebug.Protocol(sock, read_rate=read_rate)),
+        ('string', StringReader),
+    ]
+    rows = []
+    for size in (4 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20):
+        row = [size >> 10]
+        for name, reader in readers:
+            # The string reader scans the whole buffer on every recv
+            if reader is StringReader and size > 4 << 20:
+                row.extend([None, None])
+                continue
+            result = forked(read, reader, size, options.count)
+            row.extend([result['rate'] / 1e6, result['peak_kb']])
+        rows.append(row)
+    table('Frames read over a socket pair, {count} per size'.format(count=options.count),
+        [('frame KiB', '{0}'), ('Protocol MB/s', '{0:.1f}'), ('peak KiB', '{0}'),
+        ('string MB/s', '{0:.1f}'), ('peak KiB', '{0}')],
+        rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''
+Memory held per variable at a break: the dictionaries of decoded values
+the plugin kept before, the Property nodes of a session against the
+fake engine, and those nodes with the VariableTree and ContextData
+indexes of their names.
+
+    python bench_memory.py
+
+Sizes are the sum of sys.getsizeof over every object reachable from the
+stores, each object counted once, so shared strings count once.
+'''
+import base64
+import sys
+import types
+from xml.dom.minidom import parseString
+
+import sublime
+from harness import Xdebug, connect, engine, forked, settle, table
+
+opaque = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType)
+
+
+def footprint(root, exclude=()):
+    seen = set(id(obj) for obj in exclude)
+    stack = [root]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, opaque):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            for cls in type(obj).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    if hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+    return total
+
+
+def dictionaries(node, context_data):
+    '''
+    The store before Property: name : {'type', 'data'} with the value
+    decoded up front
+    '''
+    for child in node.childNodes:
+        if child.nodeName == 'property':
+            texts = [t.data for t in child.childNodes if t.nodeType == t.TEXT_NODE or t.nodeType == t.CDATA_SECTION_NODE]
+            try:
+                value = unicode(' '.join(base64.b64decode(text) for text in texts))
+            except:
+                value = unicode(' '.join(texts))
+            name = unicode(child.getAttribute('fullname'))
+            if name:
+                context_data[name] = {'type': unicode(child.getAttribute('type')), 'data': value}
+            dictionaries(child, context_data)
+    return context_data
+
+
+def measure(variables, string_size):
+    scenario = engine.Scenario(variables=variables, string_size=string_size)
+    attributes, body = scenario.on_context_get({}, None)
+    before = dictionaries(parseString(scenario.response('context_get', 1, attributes, body)).firstChild, {})
+
+    session, fake = connect(scenario)
+    if not sublime.run_until(lambda: session.location, 60):
+        raise RuntimeError('No break after connecting')
+    settle(session)
+    names = float(len(Xdebug.context_data))
+    return {
+        'names': len(before),
+        'before': footprint(before) / float(len(before)),
+        'nodes': footprint(session.variables.contexts) / names,
+        'after': footprint([session.variables, Xdebug.context_data], exclude=[session]) / names,
+    }
+
+
+def main():
+    rows = []
+    for string_size in (32, 1024):
+        for variables in (1000, 10000):
+            result = forked(measure, variables, string_size)
+            rows.append([string_size, result['names'], result['before'], result['nodes'], result['after']])
+    table('Bytes per variable held at a break',
+        [('string bytes', '{0}'), ('names', '{0}'), ('dict', '{0:.0f}'), ('Property', '{0:.0f}'),
+        ('with indexes', '{0:.0f}')], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''
+Parsing context_get replies of growing size with parse_response, and
+with minidom as the plugin did before it.
+
+    python bench_parse.py [--string-size N]
+'''
+import base64
+import optparse
+from xml.dom.minidom import parseString
+
+from harness import Xdebug, best, engine, forked, table
+
+
+def minidom_values(node, values):
+    '''
+    The properties of a DOM node as (fullname, type, value), decoded the
+    way the plugin did before parse_response
+    '''
+    for child in node.childNodes:
+        if child.nodeName == 'property':
+            texts = [t.data for t in child.childNodes if t.nodeType == t.TEXT_NODE or t.nodeType == t.CDATA_SECTION_NODE]
+            try:
+                value = unicode(' '.join(base64.b64decode(text) for text in texts))
+            except:
+                value = unicode(' '.join(texts))
+            values.append((child.getAttribute('fullname'), child.getAttribute('type'), value))
+            minidom_values(child, values)
+    return values
+
+
+def parse_minidom(data):
+    document = parseString(data)
+    return document, minidom_values(document.firstChild, [])
+
+
+def context(variables, string_size):
+    scenario = engine.Scenario(variables=variables, string_size=string_size)
+    attributes, body = scenario.on_context_get({}, None)
+    return scenario.response('context_get', 1, attributes, body)
+
+
+def memory(function, variables, string_size):
+    data = context(variables, string_size)
+    # Keep the result, a session holds on to it until the next step
+    result = function(data)
+    return {'bytes': len(data)}
+
+
+def speed(function, variables, string_size):
+    data = context(variables, string_size)
+    return {'seconds': best(lambda: function(data), repeat=3)}
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--string-size', type='int', default=32, help='bytes per string variable')
+    options, args = parser.parse_args()
+
+    rows = []
+    for variables in (100, 1000, 10000, 50000):
+        row = [variables]
+        for function in (Xdebug.parse_response, parse_minidom):
+            result = forked(memory, function, variables, options.string_size)
+            row.extend([forked(speed, function, variables, options.string_size)['seconds'] * 1000,
+                result['peak_kb']])
+        rows.append(row[:1] + [result['bytes'] >> 10] + row[1:])
+    table('context_get replies, {size} byte strings'.format(size=options.string_size),
+        [('variables', '{0}'), ('reply KiB', '{0}'), ('parse_response ms', '{0:.1f}'), ('peak KiB', '{0}'),
+        ('minidom ms', '{0:.1f}'), ('peak KiB', '{0}')], rows)
+
+
+if __name__ == '__main__':
+    main()
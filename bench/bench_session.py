@@ -0,0 +1,77 @@
+'''
+Step latency, bytes per second parsed and peak memory of a debugging
+session against the fake engine, as the scope size and the number of
+breakpoints grow.
+
+    python bench_session.py [--steps N] [--latency MS] [--log FILE]
+
+With --log the steps replay a session log instead.
+'''
+import optparse
+
+import sublime
+
+from harness import connect, engine, forked, settle, step, table, timer
+
+
+def session(variables=100, rows=0, steps=20, latency=0.0, string_size=32, log=None):
+    scenario = engine.Scenario(variables=variables, string_size=string_size)
+    started = timer()
+    session, fake = connect(scenario, latency, log=log, rows=rows)
+    if not sublime.run_until(lambda: session.location, 60):
+        raise RuntimeError('No break after connecting')
+    settle(session)
+    first_break = timer() - started
+    sent = fake and fake.bytes_sent
+    times = []
+    for i in range(steps):
+        times.append(step(session))
+        if not session.connected:
+            break
+    times.sort()
+    total = sum(times)
+    return {
+        'first_break': first_break,
+        'median': times[len(times) // 2],
+        'worst': times[-1],
+        'rate': fake and (fake.bytes_sent - sent) / total,
+        'steps': len(times),
+    }
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--steps', type='int', default=20, help='steps per measurement')
+    parser.add_option('--latency', type='float', default=0.0, help='engine latency per command in ms')
+    parser.add_option('--log', help='replay this session log')
+    options, args = parser.parse_args()
+    latency = options.latency / 1000.0
+
+    step_columns = [('steps', '{0}'), ('first break ms', '{0:.1f}'), ('median ms', '{0:.2f}'),
+        ('worst ms', '{0:.2f}'), ('peak KiB', '{0}')]
+    if options.log:
+        result = forked(session, 0, 0, options.steps, 0.0, 32, options.log)
+        table('Replay of ' + options.log, step_columns, [[result['steps'], result['first_break'] * 1000,
+            result['median'] * 1000, result['worst'] * 1000, result['peak_kb']]])
+        return
+
+    rows = []
+    for variables in (10, 100, 1000, 10000):
+        result = forked(session, variables, 0, options.steps, latency)
+        rows.append([variables, result['first_break'] * 1000, result['median'] * 1000, result['worst'] * 1000,
+            result['rate'] / 1e6, result['peak_kb']])
+    table('Step over as the scope grows, 32 byte strings, no breakpoints',
+        [('variables', '{0}'), ('first break ms', '{0:.1f}'), ('median ms', '{0:.2f}'), ('worst ms', '{0:.2f}'),
+        ('MB/s', '{0:.2f}'), ('peak KiB', '{0}')], rows)
+
+    rows = []
+    for count in (0, 10, 100, 1000):
+        result = forked(session, 100, count, options.steps, latency)
+        rows.append([count, result['first_break'] * 1000, result['median'] * 1000, result['peak_kb']])
+    table('Connecting as breakpoints grow, 100 variables',
+        [('breakpoints', '{0}'), ('first break ms', '{0:.1f}'), ('median step ms', '{0:.2f}'),
+        ('peak KiB', '{0}')], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+The cost per breakpoint hit of Run with Stats against the fake engine:
+round trips and commands per hit, the client handling time recorded in
+HitStats, and the wall time per hit. Running to each break and loading
+it, as without stats, is shown for comparison.
+
+    python bench_stats.py [--hits N] [--latency MS]
+'''
+import optparse
+
+import sublime
+from harness import Xdebug, connect, engine, forked, settle, step, table, timer
+
+
+def stats(hits, latency):
+    session, fake = connect(engine.Scenario(steps=hits + 1), latency)
+    if not sublime.run_until(lambda: session.location, 60):
+        raise RuntimeError('No break after connecting')
+    settle(session)
+    reads, commands = fake.reads, fake.commands
+    started = timer()
+    sublime.active_window().active_view().run_command('xdebug_continue', {'state': 'stats', 'session': session.id})
+    # The session lets go of its stats when it ends
+    recorded = session.stats
+    if not sublime.run_until(lambda: not session.connected, 600):
+        raise RuntimeError('Run with Stats did not finish')
+    elapsed = timer() - started
+    return {
+        'hits': recorded.hits,
+        'round_trips': float(fake.reads - reads) / recorded.hits,
+        'commands': float(fake.commands - commands) / recorded.hits,
+        'handling': recorded.handling / recorded.hits,
+        'wall': elapsed / recorded.hits,
+    }
+
+
+def breaks(hits, latency):
+    session, fake = connect(engine.Scenario(steps=hits + 1), latency)
+    if not sublime.run_until(lambda: session.location, 60):
+        raise RuntimeError('No break after connecting')
+    settle(session)
+    reads, commands = fake.reads, fake.commands
+    elapsed = sum(step(session, 'run') for i in range(hits))
+    return {
+        'hits': hits,
+        'round_trips': float(fake.reads - reads) / hits,
+        'commands': float(fake.commands - commands) / hits,
+        'handling': None,
+        'wall': elapsed / hits,
+    }
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--hits', type='int', default=2000, help='breakpoint hits per measurement')
+    parser.add_option('--latency', type='float', default=0.0, help='engine latency per command in ms')
+    options, args = parser.parse_args()
+    latency = options.latency / 1000.0
+
+    rows = []
+    for name, function, hits in (('stats', stats, options.hits), ('break', breaks, min(options.hits, 100))):
+        result = forked(function, hits, latency)
+        rows.append([name, result['hits'], result['round_trips'], result['commands'],
+            result['handling'] and result['handling'] * 1000, result['wall'] * 1000])
+    table('Breakpoint hits, 100 variables',
+        [('mode', '{0}'), ('hits', '{0}'), ('round trips', '{0:.2f}'), ('commands', '{0:.2f}'),
+        ('handling ms', '{0:.3f}'), ('wall ms', '{0:.3f}')], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+'''
+A scriptable stand-in for the DBGp engine (PHP with Xdebug).
+
+Engine plays the engine end of a connected socket on its own thread. It
+sends the init packet, then answers each command with the reply of a
+Scenario, after an optional latency. Scenario generates replies of a
+configurable size. Recorded sessions are played by Xdebug.ReplaySocket
+instead, see harness.connect.
+'''
+import base64
+import re
+import threading
+import time
+
+NS = 'xmlns="urn:debugger_protocol_v1" xmlns:xdebug="http://xdebug.org/dbgp/xdebug"'
+
+
+def frame(xml):
+    return '{length}\x00{xml}\x00'.format(length=len(xml), xml=xml)
+
+
+def parse_command(command):
+    '''
+    Split a DBGp command into its name, arguments and data
+    '''
+    command, sep, data = command.partition(' -- ')
+    name = command.split(' ', 1)[0]
+    args = dict(re.findall(r'-(\w) (\S+)', command))
+    return name, args, data and base64.b64decode(data)
+
+
+class Engine(threading.Thread):
+    '''
+    Answer the commands read from sock with the replies of scenario
+    '''
+    def __init__(self, sock, scenario, latency=0.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.scenario = scenario
+        self.latency = latency
+        self.commands = 0
+        self.reads = 0  # writes of the client, round trips unless pipelined
+        self.bytes_sent = 0
+
+    def write(self, xml):
+        packet = frame(xml)
+        self.sock.sendall(packet)
+        self.bytes_sent += len(packet)
+
+    def run(self):
+        try:
+            self.write(self.scenario.init())
+            pending = ''
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                self.reads += 1
+                pending += data
+                while '\x00' in pending:
+                    command, pending = pending.split('\x00', 1)
+                    self.commands += 1
+                    if self.latency:
+                        time.sleep(self.latency)
+                    reply = self.scenario.reply(command)
+                    if reply is not None:
+                        self.write(reply)
+        except EnvironmentError:
+            pass
+        finally:
+            self.sock.close()
+
+
+class Scenario(object):
+    '''
+    Generated replies for a script in fileuri that breaks on every step.
+
+    variables is the number of locals at each break, of which one in
+    five is an array of four ints and the others are strings of
+    string_size bytes. depth is the number of stack frames.
+    '''
+    def __init__(self, fileuri='file:///tmp/bench/index.php', variables=100, string_size=32, depth=5,
+            steps=None):
+        self.fileuri = fileuri
+        self.variables = variables
+        self.string_size = string_size
+        self.depth = depth
+        self.steps = steps
+        self.lineno = 0
+        self.breakpoint_id = 0
+        self.context = None
+
+    def init(self):
+        return '<init {ns} appid="1" idekey="sublime.xdebug" fileuri="{fileuri}" language="PHP" ' \
+            'protocol_version="1.0"/>'.format(ns=NS, fileuri=self.fileuri)
+
+    def response(self, name, tid, attributes='', body=''):
+        return '<response {ns} command="{name}" transaction_id="{tid}" {attributes}>{body}</response>'.format(
+            ns=NS, name=name, tid=tid, attributes=attributes, body=body)
+
+    def reply(self, command):
+        name, args, data = parse_command(command)
+        handler = getattr(self, 'on_' + name, None)
+        if handler:
+            attributes, body = handler(args, data)
+        else:
+            attributes, body = 'success="1"', ''
+        return self.response(name, args['i'], attributes, body)
+
+    def on_breakpoint_set(self, args, data):
+        self.breakpoint_id += 1
+        return 'state="enabled" id="{id}"'.format(id=self.breakpoint_id), ''
+
+    def on_run(self, args, data):
+        if self.steps is not None and self.lineno >= self.steps:
+            return 'status="stopping" reason="ok"', ''
+        self.lineno += 1
+        return 'status="break" reason="ok"', '<xdebug:message filename="{fileuri}" lineno="{lineno}"/>'.format(
+            fileuri=self.fileuri, lineno=self.lineno)
+
+    on_step_into = on_step_over = on_step_out = on_run
+
+    def on_stop(self, args, data):
+        return 'status="stopped" reason="ok"', ''
+
+    def on_stack_depth(self, args, data):
+        return 'depth="{depth}"'.format(depth=self.depth), ''
+
+    def on_stack_get(self, args, data):
+        frames = ['<stack where="f{level}" level="{level}" type="file" filename="{fileuri}" '
+            'lineno="{lineno}"/>'.format(level=level, fileuri=self.fileuri, lineno=self.lineno + level)
+            for level in range(self.depth)]
+        return '', ''.join(frames)
+
+    def on_context_names(self, args, data):
+        return '', '<context name="Locals" id="0"/><context name="Superglobals" id="1"/>'
+
+    def on_context_get(self, args, data):
+        if args.get('c', '0') != '0':
+            return 'context="{c}"'.format(c=args['c']), self.properties(5, '$_SERVER')
+        if self.context is None:
+            self.context = self.properties(self.variables)
+        return 'context="0"', self.context
+
+    def on_property_get(self, args, data):
+        fullname = args.get('n', '$v0')
+        return '', self.property(fullname, fullname, 'array', children=self.children(fullname, 4))
+
+    def on_property_value(self, args, data):
+        return 'size="{size}" encoding="base64"'.format(size=self.string_size), \
+            base64.b64encode('x' * self.string_size)
+
+    def on_eval(self, args, data):
+        return '', self.property('', '', 'int', value=str(len(data or '')))
+
+    def property(self, name, fullname, type, value='', children=''):
+        if type == 'array':
+            return '<property name="{name}" fullname="{fullname}" type="array" children="1" numchildren="4" ' \
+                'page="0" pagesize="32">{children}</property>'.format(name=name, fullname=fullname, children=children)
+        if type == 'string':
+            return '<property name="{name}" fullname="{fullname}" type="string" size="{size}" encoding="base64">' \
+                '<![CDATA[{value}]]></property>'.format(name=name, fullname=fullname, size=len(value),
+                value=base64.b64encode(value))
+        return '<property name="{name}" fullname="{fullname}" type="{type}"><![CDATA[{value}]]></property>'.format(
+            name=name, fullname=fullname, type=type, value=value)
+
+    def children(self, fullname, count):
+        return ''.join(self.property(str(i), '{fullname}[{i}]'.format(fullname=fullname, i=i), 'int', value=str(i))
+            for i in range(count))
+
+    def properties(self, count, prefix='$v'):
+        properties = []
+        value = ('0123456789abcdef' * (self.string_size // 16 + 1))[:self.string_size]
+        for i in range(count):
+            fullname = '{prefix}{i}'.format(prefix=prefix, i=i)
+            if i % 5 == 4:
+                properties.append(self.property(fullname, fullname, 'array', children=self.children(fullname, 4)))
+            else:
+                properties.append(self.property(fullname, fullname, 'string', value=value))
+        return ''.join(properties)
+
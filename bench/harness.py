@@ -0,0 +1,180 @@
+'''
+Helpers shared by the benchmarks: importing Xdebug.py against the stub
+sublime module, connecting sessions to a fake engine, timing and peak
+memory, and printing results.
+'''
+import cPickle
+import gc
+import os
+import resource
+import shutil
+import socket
+import sys
+import time
+
+bench = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [bench, os.path.dirname(bench)]
+
+import sublime
+import Xdebug
+import engine
+
+timer = time.time
+
+
+def connect(scenario=None, latency=0.0, log=None, rows=0, lines=None):
+    '''
+    Start a session the way the Listen command does, against scenario on
+    the other end of a socket pair, or the session log at log. Breakpoints
+    are set on the first rows lines of the script first.
+
+    Returns the session and the engine, which is None for a log.
+    '''
+    scenario = scenario or engine.Scenario()
+    window = sublime.active_window()
+    view = window.open_file(scenario.fileuri[len('file://'):])
+    view.text = '\n' * max(lines or 0, rows + 1, 100)
+    if rows:
+        Xdebug.lookup_view(view).add_breakpoints(range(1, rows + 1))
+
+    if not Xdebug.server:
+        Xdebug.server = Xdebug.Server()
+        Xdebug.script_output = Xdebug.ScriptOutput(1000000, 100)
+    listener = Xdebug.XdebugListenCommand(view)
+    if log:
+        sock, fake = Xdebug.ReplaySocket(log), None
+    else:
+        sock, other = socket.socketpair()
+        fake = engine.Engine(other, scenario, latency)
+        fake.start()
+    session = Xdebug.server.add(sock, listener.gui_callback, listener.close_callback,
+        None if log else Xdebug.server.record_path)
+    return session, fake
+
+
+def idle(session):
+    return not session.callbacks and not sublime.pending()
+
+
+def settle(session, timeout=60):
+    '''
+    Run main thread callbacks until session has no command in flight.
+    A reply is taken off callbacks just before its callback is queued, so
+    idle has to hold twice in a row.
+    '''
+    while True:
+        if not sublime.run_until(lambda: idle(session), timeout):
+            raise RuntimeError('Session did not settle in {timeout} s'.format(timeout=timeout))
+        time.sleep(0.0002)
+        sublime.run_pending()
+        if idle(session):
+            return
+
+
+def step(session, state='step_over'):
+    '''
+    Step and wait until the break is loaded and shown, returns the seconds
+    it took
+    '''
+    started = timer()
+    session.location = None
+    sublime.active_window().active_view().run_command('xdebug_continue', {'state': state, 'session': session.id})
+    settle(session)
+    return timer() - started
+
+
+def best(function, repeat=5, number=1):
+    '''
+    The best time of repeat runs of number calls to function, in seconds
+    per call
+    '''
+    times = []
+    for i in range(repeat):
+        started = timer()
+        for j in range(number):
+            function()
+        times.append((timer() - started) / number)
+    return min(times)
+
+
+def status(field):
+    '''
+    A field of /proc/self/status in KiB, None where there is no /proc
+    '''
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    except IOError:
+        pass
+
+
+def reset_peak():
+    try:
+        f = open('/proc/self/clear_refs', 'w')
+        try:
+            f.write('5')
+        finally:
+            f.close()
+    except IOError:
+        pass
+
+
+def forked(function, *args):
+    '''
+    Call function(*args) in a child process and return its result, a
+    dictionary, with 'peak_kb' set to how far the resident size of the
+    child rose above where it started. Each measurement starts from the
+    same clean process this way.
+    '''
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        status_code = 0
+        try:
+            try:
+                os.close(read)
+                sublime.packages = None
+                gc.collect()
+                reset_peak()
+                start = status('VmRSS') or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                result = function(*args)
+                peak = status('VmHWM') or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                result['peak_kb'] = max(peak - start, 0)
+                os.write(write, cPickle.dumps(result, 2))
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                status_code = 1
+        finally:
+            if sublime.packages:
+                shutil.rmtree(sublime.packages, True)
+            os._exit(status_code)
+    os.close(write)
+    chunks = []
+    while True:
+        chunk = os.read(read, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read)
+    pid, code = os.waitpid(pid, 0)
+    if code or not chunks:
+        raise RuntimeError('Benchmark child failed')
+    return cPickle.loads(''.join(chunks))
+
+
+def table(title, columns, rows):
+    '''
+    Print rows of values under columns, a list of (heading, format).
+    None is shown as a dash.
+    '''
+    print
+    print title
+    headings = [heading for heading, format in columns]
+    cells = [['-' if value is None else format.format(value) for (heading, format), value in zip(columns, row)] for row in rows]
+    widths = [max([len(heading)] + [len(line[i]) for line in cells]) for i, heading in enumerate(headings)]
+    print '  '.join(heading.rjust(width) for heading, width in zip(headings, widths))
+    for line in cells:
+        print '  '.join(cell.rjust(width) for cell, width in zip(line, widths))
+    sys.stdout.flush()
@@ -0,0 +1,32 @@
+'''
+Run the benchmarks in this directory, all of them or those named:
+
+    python bench/run.py [session ...]
+
+Each runs in its own interpreter with its default options.
+'''
+import glob
+import os
+import subprocess
+import sys
+
+bench = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    names = sys.argv[1:] or sorted(os.path.basename(path)[len('bench_'):-len('.py')]
+        for path in glob.glob(os.path.join(bench, 'bench_*.py')))
+    failed = []
+    for name in names:
+        print '== ' + name
+        sys.stdout.flush()
+        if subprocess.call([sys.executable, os.path.join(bench, 'bench_' + name + '.py')]):
+            failed.append(name)
+        print
+    if failed:
+        print 'Failed: ' + ', '.join(failed)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+'''
+A stand-in for the Sublime Text 2 API, enough to run Xdebug.py headless.
+
+Settings come from Xdebug.sublime-settings in the package, overridable
+through the settings dictionary. set_timeout queues the callback for the
+main thread, which is whichever thread calls run_pending or run_until.
+'''
+import atexit
+import heapq
+import itertools
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+HIDDEN = 1
+DRAW_OUTLINED = 2
+TRANSIENT = 4
+
+package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+messages = []
+packages = None
+
+_pending = []
+_sequence = itertools.count()
+_condition = threading.Condition()
+
+
+def set_timeout(callback, delay):
+    _condition.acquire()
+    try:
+        heapq.heappush(_pending, (time.time() + delay / 1000.0, next(_sequence), callback))
+        _condition.notify()
+    finally:
+        _condition.release()
+
+
+def run_pending():
+    '''
+    Run the callbacks that are due, returns how many ran
+    '''
+    count = 0
+    while True:
+        _condition.acquire()
+        try:
+            if not _pending or _pending[0][0] > time.time():
+                return count
+            due, sequence, callback = heapq.heappop(_pending)
+        finally:
+            _condition.release()
+        callback()
+        count += 1
+
+
+def pending():
+    '''
+    Whether a queued callback is due, timers set for later do not count
+    '''
+    return bool(_pending) and _pending[0][0] <= time.time()
+
+
+def run_until(predicate, timeout=30):
+    '''
+    Run main thread callbacks until predicate() holds, False on timeout
+    '''
+    end = time.time() + timeout
+    while True:
+        run_pending()
+        if predicate():
+            return True
+        if time.time() > end:
+            return False
+        _condition.acquire()
+        try:
+            wait = _pending and _pending[0][0] - time.time() or 0.01
+            _condition.wait(min(max(wait, 0), 0.01))
+        finally:
+            _condition.release()
+
+
+def status_message(message):
+    messages.append(message)
+
+
+def platform():
+    return 'linux'
+
+
+def packages_path():
+    '''
+    A temporary directory of this process, so nothing a run saves
+    carries over to the next
+    '''
+    global packages
+    if not packages:
+        packages = tempfile.mkdtemp(prefix='xdebug-bench-')
+        atexit.register(shutil.rmtree, packages, True)
+    return packages
+
+
+def score_selector(scope, selector):
+    return 1
+
+
+class Settings(dict):
+    def has(self, key):
+        return key in self
+
+    def set(self, key, value):
+        self[key] = value
+
+
+settings = Settings(json.load(open(os.path.join(package, 'Xdebug.sublime-settings'))))
+
+
+def load_settings(name):
+    return settings
+
+
+def save_settings(name):
+    pass
+
+
+class Region(object):
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return self.end() - self.begin()
+
+    def __repr__(self):
+        return 'Region(%d, %d)' % (self.a, self.b)
+
+
+class Selection(list):
+    def add(self, region):
+        self.append(region)
+
+    def clear(self):
+        del self[:]
+
+
+class View(object):
+    ids = itertools.count(1)
+
+    def __init__(self, window=None, file_name=None, text=''):
+        self.view_id = next(self.ids)
+        self.window_ = window
+        self.file_name_ = file_name
+        self.text = text
+        self.name_ = ''
+        self.regions = {}
+        self.selection = Selection([Region(0)])
+        self.settings_ = Settings()
+        self.read_only = False
+        self.scratch = False
+
+    def id(self):
+        return self.view_id
+
+    def buffer_id(self):
+        return self.view_id
+
+    def window(self):
+        return self.window_
+
+    def file_name(self):
+        return self.file_name_
+
+    def is_loading(self):
+        return False
+
+    def name(self):
+        return self.name_
+
+    def set_name(self, name):
+        self.name_ = name
+
+    def set_scratch(self, scratch):
+        self.scratch = scratch
+
+    def set_read_only(self, read_only):
+        self.read_only = read_only
+
+    def is_read_only(self):
+        return self.read_only
+
+    def settings(self):
+        return self.settings_
+
+    def size(self):
+        return len(self.text)
+
+    def sel(self):
+        return self.selection
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self.text[x.begin():x.end()]
+        return self.text[x]
+
+    def begin_edit(self, *args):
+        return object()
+
+    def end_edit(self, edit):
+        pass
+
+    def insert(self, edit, point, text):
+        self.text = self.text[:point] + text + self.text[point:]
+        return len(text)
+
+    def erase(self, edit, region):
+        self.text = self.text[:region.begin()] + self.text[region.end():]
+
+    def replace(self, edit, region, text):
+        self.text = self.text[:region.begin()] + text + self.text[region.end():]
+
+    def add_regions(self, key, regions, *args):
+        self.regions[key] = list(regions)
+
+    def get_regions(self, key):
+        return self.regions.get(key, [])
+
+    def erase_regions(self, key):
+        self.regions.pop(key, None)
+
+    def text_point(self, row, col):
+        point = 0
+        for i in range(row):
+            end = self.text.find('\n', point)
+            if end == -1:
+                return len(self.text)
+            point = end + 1
+        return point + col
+
+    def rowcol(self, point):
+        before = self.text[:point]
+        return before.count('\n'), point - (before.rfind('\n') + 1)
+
+    def line(self, x):
+        point = x.begin() if isinstance(x, Region) else x
+        begin = self.text.rfind('\n', 0, point) + 1
+        end = self.text.find('\n', point)
+        if end == -1:
+            end = len(self.text)
+        return Region(begin, end)
+
+    def full_line(self, x):
+        line = self.line(x)
+        return Region(line.a, min(line.b + 1, len(self.text)))
+
+    def split_by_newlines(self, region):
+        lines = []
+        point = region.begin()
+        while True:
+            line = self.line(point)
+            lines.append(Region(max(line.a, region.begin()), min(line.b, region.end())))
+            if line.b >= region.end():
+                return lines
+            point = line.b + 1
+
+    def lines(self, region):
+        return self.split_by_newlines(region)
+
+    def rows(self, regions):
+        return [self.rowcol(region.begin())[0] for region in regions]
+
+    def word(self, point):
+        line = self.line(point)
+        for match in re.finditer(r'\$?\w+', self.text[line.a:line.b]):
+            if match.start() <= point - line.a <= match.end():
+                return Region(line.a + match.start(), line.a + match.end())
+        return Region(point)
+
+    def scope_name(self, point):
+        return 'source.php variable.other.php'
+
+    def show_at_center(self, x):
+        pass
+
+    def show(self, *args):
+        pass
+
+    def run_command(self, name, args=None):
+        import sublime_plugin
+        sublime_plugin.run_command(self, name, args or {})
+
+
+class Window(object):
+    def __init__(self):
+        self.views_ = []
+        self.panels = {}
+        self.layout = {}
+        self.commands = []
+        self.active = None
+        self.folders_ = []
+
+    def id(self):
+        return 1
+
+    def views(self):
+        return list(self.views_)
+
+    def new_file(self):
+        view = View(self)
+        self.views_.append(view)
+        return view
+
+    def open_file(self, file_name, flags=0):
+        text = '\n' * 100
+        if os.path.isfile(file_name):
+            text = open(file_name).read()
+        view = View(self, file_name, text)
+        self.views_.append(view)
+        self.active = view
+        return view
+
+    def close(self, view):
+        self.views_.remove(view)
+
+    def focus_view(self, view):
+        self.active = view
+
+    def focus_group(self, group):
+        pass
+
+    def active_view(self):
+        return self.active or (self.views_ and self.views_[0]) or View(self)
+
+    def set_view_index(self, *args):
+        pass
+
+    def get_view_index(self, view):
+        return (0, 0)
+
+    def get_output_panel(self, name):
+        if name not in self.panels:
+            self.panels[name] = View(self)
+        return self.panels[name]
+
+    def run_command(self, *args):
+        self.commands.append(args)
+
+    def get_layout(self):
+        return self.layout
+
+    def set_layout(self, layout):
+        self.layout = layout
+
+    def show_quick_panel(self, items, callback, *args):
+        self.quick_panel = (items, callback)
+
+    def show_input_panel(self, caption, initial, on_done, on_change, on_cancel):
+        self.input_panel = (caption, initial, on_done)
+
+    def folders(self):
+        return list(self.folders_)
+
+
+_windows = [Window()]
+
+
+def active_window():
+    return _windows[0]
+
+
+def windows():
+    return list(_windows)
+
+
+def reset():
+    '''
+    Forget all windows, views, queued callbacks and messages
+    '''
+    _windows[:] = [Window()]
+    del _pending[:]
+    del messages[:]
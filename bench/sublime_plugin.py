@@ -0,0 +1,30 @@
+'''
+A stand-in for the sublime_plugin module, see sublime.py
+'''
+
+
+class TextCommand(object):
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand(object):
+    def __init__(self, window):
+        self.window = window
+
+
+class EventListener(object):
+    pass
+
+
+def run_command(view, name, args):
+    '''
+    Run a text command of Xdebug.py the way Sublime does, by class name
+    '''
+    import Xdebug
+    base = ''.join(part.capitalize() for part in name.split('_'))
+    cls = getattr(Xdebug, base + 'Command', None) or getattr(Xdebug, base)
+    command = cls(view)
+    if hasattr(command, 'is_enabled') and not command.is_enabled(**args):
+        return
+    command.run(None, **args)